@@ -1,5 +1,12 @@
+import time
 import types
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+
+import tf.advanced.app as tfApp
 from tf.advanced.app import App
+from tf.advanced.helpers import parseFeatures
+from tf.core.helpers import console
 
 
 MODIFIERS = """
@@ -13,60 +20,361 @@ MODIFIERS = """
     supplied
 """.strip().split()
 
+# sign types that are rendered in a special way, other types render their atf or sym
+
+(OTHER, EMPTY, UNKNOWN, ELLIPSIS, READING, GRAPHEME) = range(6)
+
+TYPE_CODES = dict(
+    empty=EMPTY, unknown=UNKNOWN, ellipsis=ELLIPSIS, reading=READING, grapheme=GRAPHEME
+)
+
+# features that are needed for display; those that are only needed for display
+# are excluded in config.yaml, so that `use()` does not load them;
+# they are loaded when they are first needed; search loads the features of its
+# query by itself
+
+DISPLAY_FEATURES = ("det", "lang", "reading", "grapheme")
+
+# display methods of the app that need the display features
+
+DISPLAY_METHODS = "export table plainTuple plain show prettyTuple pretty".split()
+
+# the modifiers that are present in the data, per data version
+
+MODIFIERS_BY_VERSION = {}
+
+# maximum number of rendered signs that are kept, without their wrapping spans
+
+RENDER_CACHE = 1 << 16
+
+
+LAYOUT_KINDS = {"layout-orig-full": "atf", "layout-orig-plain": "sym"}
+
 
 def fmt_layoutFull(app, n, **kwargs):
-    return app._wrapHtml(n, "atf")
+    app._displayReady or app._setupDisplay()
+    return app._renderSlots((n,), "atf", False)
 
 
 def fmt_layoutPlain(app, n, **kwargs):
-    return app._wrapHtml(n, "sym")
+    app._displayReady or app._setupDisplay()
+    return app._renderSlots((n,), "sym", False)
+
+
+def lazyConfig(cfg):
+    """Remove the excluded features from the features shown with signs.
+
+    TF checks at startup that the features to show are loaded, but the excluded
+    ones will only be loaded when they are first needed.
+    Returns the adapted config and the original sign features.
+    """
+    excluded = set(cfg.get("dataDisplay", {}).get("excludedFeatures", []))
+    typeDisplay = cfg.get("typeDisplay", {})
+    signSpec = typeDisplay.get("sign", {})
+    signFeatures = signSpec.get("features", "")
+    remaining = " ".join(f for f in signFeatures.split() if f not in excluded)
+
+    cfg = dict(cfg)
+    cfg["typeDisplay"] = dict(typeDisplay)
+    cfg["typeDisplay"]["sign"] = dict(signSpec, features=remaining)
+    return (cfg, signFeatures)
+
+
+@contextmanager
+def patched(owner, name, wrap):
+    """Temporarily replace an attribute of a TF module by a wrapper of it."""
+    own = name in vars(owner)
+    original = getattr(owner, name)
+    setattr(owner, name, wrap(original))
+    try:
+        yield
+    finally:
+        if own:
+            setattr(owner, name, original)
+        else:
+            delattr(owner, name)
+
+
+def recordSpans(function, spans):
+    """Wrap a function so that it records the start and end of every call."""
+
+    @wraps(function)
+    def wrapped(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            spans.append((start, time.perf_counter()))
+
+    return wrapped
+
+
+# the phases of use(): TF loads the data in two rounds,
+# first the warp features with precomputing, then the other features
+
+LOAD_PHASES = ("use: warp features and precomputing", "use: features")
 
 
 class TfApp(App):
-    def __init__(app, *args, **kwargs):
+    def __init__(app, cfg, *args, **kwargs):
         app.fmt_layoutFull = types.MethodType(fmt_layoutFull, app)
         app.fmt_layoutPlain = types.MethodType(fmt_layoutPlain, app)
-        super().__init__(*args, **kwargs)
-        api = app.api
-        Fall = api.Fall
-        allNodeFeatures = set(Fall())
-        app.modifiers = [m for m in MODIFIERS if m in allNodeFeatures]
+        app._displayReady = False
+        app.timings = []
+
+        start = time.perf_counter()
+        app._TF = None
+        app._loads = []
+        (cfg, app._signFeatures) = lazyConfig(cfg)
+        super().__init__(cfg, *args, **kwargs)
+        loads = app._loads
+        app._loads = None
+        if app._TF is not None:
+            vars(app._TF).pop("load", None)
+        app._usePhases(start, loads)
+
+        if not app.api:
+            return
+
+        start = time.perf_counter()
+        app.modifiers = app._getModifiers()
+        app._hookDisplay()
+        app._timed("app: modifiers and display hooks", start)
+
+        if app._browse:
+            app._setupDisplay()
+
+    # TF sets `app.TF` as soon as it has made the Fabric, before it loads data;
+    # while the app initializes, the loads of that Fabric, and of no other, are timed
+
+    @property
+    def TF(app):
+        return app._TF
+
+    @TF.setter
+    def TF(app, TF):
+        loads = app._loads
+        if TF is not None and loads is not None and "load" not in vars(TF):
+            TF.load = recordSpans(TF.load, loads)
+        app._TF = TF
+
+    def reuse(app, hoist=False):
+        """Re-initialize the app, see `tf.advanced.app.App.reuse`.
 
-    def _wrapHtml(app, n, kind):
+        The config is read again and made lazy again, as in `use()`,
+        and the display methods are hooked again.
+        The display features stay loaded if they are loaded already.
+        """
+
+        def lazyFind(findAppConfig):
+            def find(*args, **kwargs):
+                (cfg, app._signFeatures) = lazyConfig(findAppConfig(*args, **kwargs))
+                return cfg
+
+            return find
+
+        with patched(tfApp, "findAppConfig", lazyFind):
+            super().reuse(hoist=hoist)
+
+        if app.api:
+            app._displayReady = False
+            app._hookDisplay()
+            if app._browse:
+                app._setupDisplay()
+
+    def _timed(app, phase, start):
+        app.timings.append((phase, time.perf_counter() - start))
+
+    def _usePhases(app, start, loads):
+        """Split the time of `use()` in phases by the loading rounds of TF."""
+        end = time.perf_counter()
+        if not loads:
+            app.timings.append(("use: config and api", end - start))
+            return
+
+        app.timings.append(("use: config and locating data", loads[0][0] - start))
+        prevEnd = loads[0][0]
+        for (i, (loadStart, loadEnd)) in enumerate(loads):
+            phase = LOAD_PHASES[min(i, len(LOAD_PHASES) - 1)]
+            app.timings.append((phase, loadEnd - prevEnd))
+            prevEnd = loadEnd
+        app.timings.append(("use: app and api setup", end - loads[-1][1]))
+
+    def _hookDisplay(app):
+        """Make the display methods load the display features on first use."""
+        for name in DISPLAY_METHODS:
+            method = getattr(app, name, None)
+            if method is not None:
+                setattr(app, name, app._withDisplay(method))
+        app._material = lru_cache(maxsize=RENDER_CACHE)(app._signMaterial)
+
+    def startupReport(app):
+        """Show how long the phases of loading this app took.
+
+        The display features are loaded on first use, their phases show up
+        after that.
+        """
+        for (phase, elapsed) in app.timings:
+            console(f"{elapsed:>7.3f}s {phase}")
+        console(f"{sum(e for (p, e) in app.timings):>7.3f}s total")
+
+    def _getModifiers(app):
+        """The modifiers that are present in the data, without loading them."""
+        version = app.context.version
+        modifiers = MODIFIERS_BY_VERSION.get(version, None)
+        if modifiers is None:
+            present = app.TF.features
+            modifiers = [m for m in MODIFIERS if m in present]
+            MODIFIERS_BY_VERSION[version] = modifiers
+        return modifiers
+
+    def _withDisplay(app, method):
+        @wraps(method)
+        def wrapped(*args, **kwargs):
+            app._displayReady or app._setupDisplay()
+            return method(*args, **kwargs)
+
+        return wrapped
+
+    def _setupDisplay(app):
+        """Load the display features and compute the per sign arrays.
+
+        After that the signs are shown with all their features as configured.
+        """
+        start = time.perf_counter()
+        app.api.ensureLoaded(DISPLAY_FEATURES + tuple(app.modifiers))
+        app.api.ensureLoaded(app._signFeatures)
+        app.context.features["sign"] = parseFeatures(app._signFeatures)
+        app._timed("display: load features", start)
+
+        start = time.perf_counter()
+        app._setupSigns()
+        app._timed("display: sign arrays", start)
+        app._displayReady = True
+        return True
+
+    def _setupSigns(app):
+        """Compute per sign arrays for rendering.
+
+        For every sign we store a type code and a bitmask with a bit for every
+        modifier that is present, and bits for being a determinative and for being
+        in another language than Akkadian.
+        For every bitmask that occurs we compute the spans that wrap the sign.
+        """
         modifiers = app.modifiers
         api = app.api
         F = api.F
         Fs = api.Fs
-        typ = F.type.v(n)
-        after = F.after.v(n)
-        if typ == "empty":
-            material = '<span class="empty">∅</span>'
-        elif typ == "unknown":
+        maxSlot = F.otype.maxSlot
+
+        typeCodes = bytearray(maxSlot + 1)
+        for (n, typ) in F.type.items():
+            if n <= maxSlot:
+                typeCodes[n] = TYPE_CODES.get(typ, OTHER)
+
+        masks = [0] * (maxSlot + 1)
+        for (i, cf) in enumerate(modifiers):
+            bit = 1 << i
+            for (n, v) in Fs(cf).items():
+                if v and n <= maxSlot:
+                    masks[n] |= bit
+
+        detBit = 1 << len(modifiers)
+        langBit = detBit << 1
+        for (n, v) in F.det.items():
+            if v and n <= maxSlot:
+                masks[n] |= detBit
+        for (n, v) in F.lang.items():
+            if v and v != "akk" and n <= maxSlot:
+                masks[n] |= langBit
+
+        wrappers = {}
+        for mask in set(masks):
+            clses = " ".join(cf for (i, cf) in enumerate(modifiers) if mask & (1 << i))
+            opening = []
+            if mask & langBit:
+                opening.append('<span class="lang">')
+            if mask & detBit:
+                opening.append('<span class="det">')
+            if clses:
+                opening.append(f'<span class="{clses}">')
+            wrappers[mask] = ("".join(opening), "</span>" * len(opening))
+
+        app._typeCodes = typeCodes
+        app._masks = masks
+        app._wrappers = wrappers
+
+    def layout(app, nodes, fmt="layout-orig-full", merge=True):
+        """Render nodes in a layout format, in one pass over their slots.
+
+        `nodes` is a node of any type, e.g. a line, face or document, or an iterable
+        of nodes; for a single node the result is a string, otherwise a list of
+        strings.
+
+        If `merge`, adjacent signs with the same classes are wrapped in a single span,
+        together with the material after them, except after the last sign.
+        Otherwise the result is as `T.text(n, fmt=fmt)`.
+        """
+        app._displayReady or app._setupDisplay()
+        kind = LAYOUT_KINDS[fmt]
+        eoslots = app.api.E.oslots.s
+        maxSlot = app.api.F.otype.maxSlot
+
+        def slotsOf(n):
+            if n <= maxSlot:
+                return (n,)
+            slots = eoslots(n)
+            (first, last) = (slots[0], slots[-1])
+            return range(first, last + 1) if last - first + 1 == len(slots) else slots
+
+        if type(nodes) is int:
+            return app._renderSlots(slotsOf(nodes), kind, merge)
+        return [app._renderSlots(slotsOf(n), kind, merge) for n in nodes]
+
+    def _renderSlots(app, slots, kind, merge):
+        masks = app._masks
+        wrappers = app._wrappers
+        material = app._material
+        after = app.api.F.after.v
+
+        html = []
+        curMask = None
+        closing = ""
+        prevAfter = ""
+
+        for n in slots:
+            mask = masks[n]
+            if merge and mask == curMask:
+                html.append(prevAfter)
+                html.append(material(n, kind))
+            else:
+                html.append(closing)
+                html.append(prevAfter)
+                (opening, closing) = wrappers[mask]
+                html.append(opening)
+                html.append(material(n, kind))
+                curMask = mask
+            prevAfter = f"{after(n)}"
+
+        html.append(closing)
+        html.append(prevAfter)
+        return "".join(html)
+
+    def _signMaterial(app, n, kind):
+        api = app.api
+        F = api.F
+        typ = app._typeCodes[n]
+
+        if typ == READING:
+            return f'<span class="r">{F.reading.v(n) or ""}</span>'
+        if typ == GRAPHEME:
+            return f'<span class="g">{F.grapheme.v(n) or ""}</span>'
+        if typ == UNKNOWN:
             part = F.sym.v(n) or ""
-            if part:
-                cls = "g" if part.isupper() else "r"
-                if cls == "g":
-                    partR = ""
-                    partG = f'<span class="cls">{part}</span>'
-                else:
-                    partR = f'<span class="cls">{part}</span>'
-                    partG = ""
-            material = f'<span class="uncertain">{partR}{partG}</span>'
-        elif typ == "ellipsis":
-            material = f'<span class="missing">{F.sym.v(n)}</span>'
-        elif typ == "reading":
-            material = f'<span class="r">{F.reading.v(n)}</span>'
-        elif typ == "grapheme":
-            material = f'<span class="g">{F.grapheme.v(n)}</span>'
-        elif typ == "numeral":
-            material = Fs(kind).v(n)
-        else:
-            material = Fs(kind).v(n)
-        clses = " ".join(cf for cf in modifiers if Fs(cf).v(n))
-        if clses:
-            material = f'<span class="{clses}">{material}</span>'
-        if F.det.v(n):
-            material = f'<span class="det">{material}</span>'
-        if F.lang.v(n) and F.lang.v(n) != "akk":
-            material = f'<span class="lang">{material}</span>'
-        return f"{material}{after}"
+            part = f'<span class="cls">{part}</span>' if part else ""
+            return f'<span class="uncertain">{part}</span>'
+        if typ == ELLIPSIS:
+            return f'<span class="missing">{F.sym.v(n) or ""}</span>'
+        if typ == EMPTY:
+            return '<span class="empty">∅</span>'
+        return api.Fs(kind).v(n) or ""
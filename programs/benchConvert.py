@@ -0,0 +1,320 @@
+import sys
+import os
+import json
+import time
+import resource
+import subprocess
+
+import tfFromJson
+from jsonSource import (
+    Manifest,
+    ParseCache,
+    getJsonFiles,
+    readJsonFiles,
+    streamJsonFile,
+)
+from tfFromJson import META_FIELDS, OUT_DIR, TEMP_DIR, VERSION_TF
+
+HELP = """
+python3 benchConvert.py
+    Measure the phases of a complete conversion: generate TF and load it
+python3 benchConvert.py -skipload
+    Measure the phases of generating TF, without loading it
+python3 benchConvert.py -skipgen
+    Measure loading the TF that is in the repository, or of the synthetic corpus
+
+Options, to be combined with the commands above:
+
+-save
+    Store the results as the baseline of this flow
+-tolerance=n
+    Flag phases that are more than n percent slower or bigger than the baseline,
+    instead of 25 percent
+-stream
+-cache
+    Read the JSON as the converter does with these options
+-synthetic=n
+    Work on the synthetic corpus of n times the real size, see synthCorpus.py
+
+The phases are:
+
+discovery   finding the JSON files
+decoding    decoding all JSON files, as the converter does
+director    the walk through the corpus by the director, including the decoding
+writing     the rest of cv.walk: checking, ordering and writing the TF features
+loading     loading the TF features, including precomputing, as loadTf() does
+
+Every phase group runs in a fresh process, because peak memory cannot be reset.
+The TF is generated as a complete conversion, without reusing fragments, into a
+temporary directory, so that the TF in the repository stays untouched.
+TF of a synthetic corpus is generated in the directory of that corpus.
+
+The results of the last run and the baselines are stored as JSON in the temp
+directory; if a phase regresses beyond the tolerance, the exit status is 1.
+"""
+
+BENCH_DIR = f"{TEMP_DIR}/bench"
+BENCH_TF_DIR = f"{BENCH_DIR}/tf/{VERSION_TF}"
+BASELINE_FILE = f"{BENCH_DIR}/convert-baseline.json"
+LATEST_FILE = f"{BENCH_DIR}/convert-latest.json"
+
+TOLERANCE = 25
+
+# timings below this many seconds are dominated by noise
+
+SLACK = 0.05
+
+FLOWS = {
+    "full": ("discovery", "decoding", "convert", "load"),
+    "-skipload": ("discovery", "decoding", "convert"),
+    "-skipgen": ("loadRepo",),
+}
+READ_OPTIONS = {"-stream", "-cache"}
+
+
+def msg(m):
+    sys.stdout.write(f"{m}\n")
+
+
+def peakRss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+# CHILD PROCESSES: each runs a group of phases and reports them as JSON
+
+
+def isReadOption(arg):
+    return arg in READ_OPTIONS or arg.startswith("-synthetic=")
+
+
+def targetDir():
+    """Where to generate TF: not in the repository."""
+    return BENCH_TF_DIR if tfFromJson.OUT_DIR == OUT_DIR else tfFromJson.OUT_DIR
+
+
+def runDiscovery(options):
+    start = time.perf_counter()
+    paths = getJsonFiles(tfFromJson.IN_DIR)
+    return dict(discovery=dict(seconds=time.perf_counter() - start, files=len(paths)))
+
+
+def runDecoding(options):
+    paths = getJsonFiles(tfFromJson.IN_DIR)
+    metaKeys = {origField.split(".", 1)[0] for origField in META_FIELDS}
+    nLines = 0
+
+    start = time.perf_counter()
+    if "-stream" in options:
+        for path in paths:
+            (header, lines) = streamJsonFile(path, metaKeys)
+            for line in lines:
+                nLines += 1
+    else:
+        cache = (
+            ParseCache(
+                tfFromJson.PARSE_DIR,
+                Manifest(tfFromJson.IN_DIR, tfFromJson.MANIFEST_FILE),
+            )
+            if "-cache" in options
+            else None
+        )
+        for (path, docData) in readJsonFiles(
+            paths, keys=metaKeys | {"text"}, cache=cache
+        ):
+            nLines += len(docData["text"]["allLines"])
+    return dict(decoding=dict(seconds=time.perf_counter() - start, lines=nLines))
+
+
+def runConvert(options):
+    tfFromJson.OUT_DIR = targetDir()
+    tfFromJson.INCREMENTAL = False
+    tfFromJson.STREAM = "-stream" in options
+    tfFromJson.CACHE = "-cache" in options
+    tfFromJson.generateTf = True
+
+    director = tfFromJson.director
+    directed = {}
+
+    def timedDirector(cv):
+        start = time.perf_counter()
+        director(cv)
+        directed.update(seconds=time.perf_counter() - start, peakKb=peakRss())
+
+    tfFromJson.director = timedDirector
+
+    start = time.perf_counter()
+    good = tfFromJson.convert()
+    seconds = time.perf_counter() - start
+
+    if not good:
+        return None
+    return dict(
+        director=directed,
+        writing=dict(seconds=seconds - directed["seconds"]),
+    )
+
+
+def runLoad(location):
+    tfFromJson.OUT_DIR = location
+    start = time.perf_counter()
+    tfFromJson.loadTf()
+    return dict(loading=dict(seconds=time.perf_counter() - start))
+
+
+GROUPS = dict(
+    discovery=runDiscovery,
+    decoding=runDecoding,
+    convert=runConvert,
+    load=lambda options: runLoad(targetDir()),
+    loadRepo=lambda options: runLoad(tfFromJson.OUT_DIR),
+)
+
+
+def child(group, options):
+    for option in options:
+        if option.startswith("-synthetic="):
+            tfFromJson.useSynthetic(int(option.split("=", 1)[1]))
+    result = GROUPS[group](options)
+    if result is not None:
+        last = list(result.values())[-1]
+        last.setdefault("peakKb", peakRss())
+    sys.stdout.write(f"\n{json.dumps(result)}\n")
+
+
+# THE HARNESS
+
+
+def measure(group, options):
+    result = subprocess.run(
+        [sys.executable, __file__, "-child", group, *sorted(options)],
+        capture_output=True,
+        text=True,
+    )
+    lines = result.stdout.strip().split("\n")
+    phases = json.loads(lines[-1]) if result.returncode == 0 and lines else None
+    if not phases:
+        msg(f"Phase group {group} failed:")
+        msg("\n".join(lines[-10:]))
+        msg(result.stderr[-2000:])
+        return None
+    return phases
+
+
+def readJson(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def writeJson(data, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fh:
+        json.dump(data, fh, indent=1)
+        fh.write("\n")
+
+
+def compare(phases, base, tolerance):
+    """Show the phases next to their baseline and return the regressions."""
+    factor = 1 + tolerance / 100
+    regressions = []
+
+    msg(f"{'phase':<10} {'seconds':>8} {'base':>8} {'peak MB':>8} {'base':>8}")
+    for (phase, info) in phases.items():
+        baseInfo = base.get(phase, {})
+        seconds = info["seconds"]
+        peakMb = info["peakKb"] / 1024
+        baseSeconds = baseInfo.get("seconds", None)
+        basePeakMb = baseInfo["peakKb"] / 1024 if "peakKb" in baseInfo else None
+
+        flags = []
+        if baseSeconds is not None and seconds > baseSeconds * factor + SLACK:
+            flags.append("time")
+        if basePeakMb is not None and peakMb > basePeakMb * factor:
+            flags.append("memory")
+        if flags:
+            regressions.append((phase, flags))
+
+        baseSecondsRep = "" if baseSeconds is None else f"{baseSeconds:>8.2f}"
+        basePeakRep = "" if basePeakMb is None else f"{basePeakMb:>8.1f}"
+        flagRep = f" REGRESSION in {' and '.join(flags)}" if flags else ""
+        msg(
+            f"{phase:<10} {seconds:>8.2f} {baseSecondsRep:>8} "
+            f"{peakMb:>8.1f} {basePeakRep:>8}{flagRep}"
+        )
+    return regressions
+
+
+def main(flow, options, tolerance, save):
+    readOptions = sorted(arg for arg in options if isReadOption(arg))
+    label = " ".join([flow, *readOptions])
+    msg(f"Benchmark of the conversion: {label}")
+
+    phases = {}
+    for group in FLOWS[flow]:
+        result = measure(group, readOptions)
+        if result is None:
+            return False
+        phases.update(result)
+
+    run = dict(
+        flow=label,
+        source=tfFromJson.IN_DIR,
+        date=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        phases=phases,
+    )
+    writeJson(run, LATEST_FILE)
+
+    baselines = readJson(BASELINE_FILE)
+    base = baselines.get(label, {}).get("phases", {})
+    if not base:
+        msg(f"No baseline for {label} yet")
+
+    regressions = compare(phases, base, tolerance)
+
+    if save:
+        baselines[label] = run
+        writeJson(baselines, BASELINE_FILE)
+        msg(f"Baseline for {label} saved in {BASELINE_FILE}")
+    elif regressions:
+        msg(f"{len(regressions)} phase(s) regressed more than {tolerance}%")
+        return False
+    return True
+
+
+args = sys.argv[1:]
+
+if len(args) >= 2 and args[0] == "-child":
+    child(args[1], set(args[2:]))
+else:
+    tolerances = [arg for arg in args if arg.startswith("-tolerance=")]
+    options = {arg for arg in args if isReadOption(arg) or arg == "-save"}
+    commands = [arg for arg in args if arg not in options and arg not in tolerances]
+
+    tolerance = TOLERANCE
+    good = True
+    for arg in tolerances:
+        value = arg.split("=", 1)[1]
+        if value.isdigit():
+            tolerance = int(value)
+        else:
+            msg(f"Wrong option {arg} !")
+            good = False
+
+    if not good:
+        pass
+    elif len(commands) > 1:
+        msg(f"Too many commands {' '.join(commands)} !\n{HELP}")
+        good = False
+    elif len(commands) == 0:
+        good = main("full", options, tolerance, "-save" in options)
+    elif commands[0] in FLOWS and commands[0] != "full":
+        good = main(commands[0], options, tolerance, "-save" in options)
+    else:
+        msg(f"Wrong command {commands[0]} !\n{HELP}")
+        good = False
+
+    if not good:
+        sys.exit(1)
@@ -0,0 +1,150 @@
+import sys
+import time
+
+from tokenFromJson import getJsonFiles, readJsonFile
+from lineLexer import WORD, SIGN, OTHER, lexLine
+
+HELP = """
+python3 benchLexer.py
+    Compare the line lexer with the two pass flattening of line content that the
+    director did before, on all text lines of the real corpus, and check that they
+    deliver the same tokens
+python3 benchLexer.py n
+    Same, but take the best of n rounds instead of 10
+"""
+
+ROUNDS = 10
+
+
+def msg(m):
+    sys.stdout.write(f"{m}\n")
+
+
+# THE FLATTENING AS IT WAS: a list of entries, then two backward passes for isLast
+
+
+def legacyFlatten(lineContent):
+    lineSigns = []
+
+    for wordData in lineContent:
+        if "parts" in wordData:
+            lineSigns.append([True, wordData, False])
+            for signData in wordData["parts"]:
+                hasSubs = False
+                for (kind, tp) in (
+                    ("parts", "Determinative"),
+                    ("tokens", "Variant"),
+                ):
+                    if kind in signData:
+                        hasSubs = True
+                        end = len(signData[kind])
+                        for (i, subPart) in enumerate(signData[kind]):
+                            lineSigns.append(
+                                [False, subPart, False, tp, i, i == end - 1]
+                            )
+                if not hasSubs:
+                    lineSigns.append([False, signData, False])
+        else:
+            lineSigns.append([None, wordData, None])
+
+    for entry in reversed(lineSigns):
+        isWord = entry[0]
+        if isWord:
+            entry[2] = True
+            break
+
+    atWordEnd = True
+    for entry in reversed(lineSigns):
+        isWord = entry[0]
+        if isWord is False:
+            if atWordEnd:
+                entry[2] = True
+                atWordEnd = False
+        elif isWord is True:
+            atWordEnd = True
+
+    return lineSigns
+
+
+LEGACY_KINDS = {True: WORD, False: SIGN, None: OTHER}
+
+
+def legacyTokens(lineContent):
+    """The legacy entries in the shape of the tokens of the lexer."""
+    return [
+        (
+            LEGACY_KINDS[entry[0]],
+            id(entry[1]),
+            bool(entry[2]),
+            *(entry[3:6] if len(entry) > 3 else (None, None, None)),
+        )
+        for entry in legacyFlatten(lineContent)
+    ]
+
+
+def lexerTokens(lineContent):
+    return [
+        (kind, id(data), isLast, group, index, atEnd)
+        for (kind, data, isLast, group, index, atEnd, part) in lexLine(lineContent)
+    ]
+
+
+def best(rounds, tasks):
+    """The best times of tasks, which take turns in every round.
+
+    Taking turns spreads the fluctuations of the machine evenly over the tasks.
+    """
+    times = [[] for task in tasks]
+    for r in range(rounds):
+        for (task, taskTimes) in zip(tasks, times):
+            start = time.perf_counter()
+            task()
+            taskTimes.append(time.perf_counter() - start)
+    return [min(taskTimes) for taskTimes in times]
+
+
+def main(rounds):
+    lines = [
+        lineData["content"]
+        for path in getJsonFiles()
+        for lineData in readJsonFile(path)["text"]["allLines"]
+        if lineData["type"] == "TextLine"
+    ]
+
+    legacy = [legacyTokens(content) for content in lines]
+    lexed = [lexerTokens(content) for content in lines]
+    nTokens = sum(len(tokens) for tokens in lexed)
+    same = "same" if legacy == lexed else "DIFFERENT"
+    msg(f"{len(lines)} text lines, {nTokens} tokens, {same}, best of {rounds} rounds")
+
+    def runLegacy():
+        n = 0
+        for content in lines:
+            for entry in legacyFlatten(content):
+                n += 1
+        return n
+
+    def runLexer():
+        n = 0
+        for content in lines:
+            for token in lexLine(content):
+                n += 1
+        return n
+
+    (legacyTime, lexerTime) = best(rounds, (runLegacy, runLexer))
+
+    for (label, seconds) in (("legacy", legacyTime), ("lexer", lexerTime)):
+        msg(
+            f"{label:<8} {seconds:>7.3f}s {nTokens / seconds / 1e6:>6.2f}M tokens/s"
+        )
+    msg(f"lexer x{legacyTime / lexerTime:>5.2f}")
+
+
+command = None if len(sys.argv) <= 1 else sys.argv[1]
+
+if command is None:
+    main(ROUNDS)
+elif command.isdigit():
+    main(int(command))
+else:
+    msg(f"Wrong command {command} !\n{HELP}")
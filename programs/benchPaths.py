@@ -0,0 +1,179 @@
+import sys
+import time
+import collections
+
+from tokenFromJson import (
+    SKIP_KEYS,
+    getJsonFiles,
+    readJsonFile,
+    corpusReports,
+    AnalyseReport,
+    analyseKeys,
+    filter,
+)
+
+HELP = """
+python3 benchPaths.py
+    Compare the compiled path queries with the string based walkers they replaced,
+    on the real corpus, and check that they find the same things
+python3 benchPaths.py n
+    Same, but take the best of n rounds instead of 3
+"""
+
+ROUNDS = 3
+
+
+def msg(m):
+    sys.stdout.write(f"{m}\n")
+
+
+# THE WALKERS AS THEY WERE: one walk per key, a path string for every node
+
+
+def legacyAnalyse(data, theKey, instead=None, full=False):
+    entries = collections.defaultdict(set)
+    if instead is not None:
+        (theValue, otherKey) = instead[0:2]
+        subKey = instead[2] if len(instead) >= 3 else None
+
+    def walk(path, info, parent):
+        if not full and path in SKIP_KEYS:
+            return
+        if path == theKey or path.endswith(f".{theKey}") or path.endswith(f"]{theKey}"):
+            if instead is None:
+                entries[path].add(repr(info))
+            else:
+                if info == theValue:
+                    lookup = parent[otherKey]
+                    if subKey is not None:
+                        lookup = (
+                            tuple(c[subKey] for c in lookup)
+                            if type(lookup) is list
+                            else lookup[subKey]
+                        )
+
+                    entries[path].add(lookup)
+        elif type(info) is dict:
+            for (k, v) in sorted(info.items()):
+                pathRep = f"{path}." if path else ""
+                walk(f"{pathRep}{k}", v, info)
+        elif type(info) is list:
+            for v in info:
+                pathRep = f"{path}[]" if path else ""
+                walk(f"{pathRep}", v, info)
+
+    walk("", data, {})
+    return entries
+
+
+def legacyFilter(data, exclude=set()):
+    filtered = []
+
+    def walk(path, info):
+        if path in exclude:
+            return
+        if type(info) is dict:
+            for (k, v) in sorted(info.items()):
+                pathRep = f"{path}." if path else ""
+                walk(f"{pathRep}{k}", v)
+        elif type(info) is list:
+            for (k, v) in enumerate(info):
+                pathRep = f"{path}[{k}]" if path else ""
+                walk(f"{pathRep}", v)
+        else:
+            if type(info) is str:
+                nInfo = len(info)
+                if nInfo > 20:
+                    info = info[0:20].replace("\n", " ") + "..."
+            filtered.append((path, info))
+
+    walk("", data)
+    return filtered
+
+
+def best(rounds, tasks):
+    """The best times and the results of tasks, which take turns in every round.
+
+    Taking turns spreads the fluctuations of the machine evenly over the tasks.
+    """
+    times = [[] for task in tasks]
+    results = [None for task in tasks]
+    for r in range(rounds):
+        for (i, task) in enumerate(tasks):
+            start = time.perf_counter()
+            results[i] = task()
+            times[i].append(time.perf_counter() - start)
+    return ([min(taskTimes) for taskTimes in times], results)
+
+
+def merged(inventories):
+    total = collections.defaultdict(set)
+    for entries in inventories:
+        for (path, values) in entries.items():
+            total[path] |= values
+    return dict(total)
+
+
+def compare(label, rounds, legacyTask, newTask):
+    ((legacyTime, newTime), (legacyResult, newResult)) = best(
+        rounds, (legacyTask, newTask)
+    )
+    same = "same" if legacyResult == newResult else "DIFFERENT"
+    msg(
+        f"{label:<32} legacy {legacyTime:>7.3f}s compiled {newTime:>7.3f}s "
+        f"x{legacyTime / newTime:>5.1f} {same}"
+    )
+
+
+def main(rounds):
+    docs = [readJsonFile(path) for path in getJsonFiles()]
+    specs = [
+        report.spec for report in corpusReports() if isinstance(report, AnalyseReport)
+    ]
+    msg(f"{len(docs)} documents, {len(specs)} keys, best of {rounds} rounds")
+
+    for spec in specs:
+        (theKey, instead, full) = spec
+        label = theKey if instead is None else f"{theKey}-{instead[0]}"
+        compare(
+            label,
+            rounds,
+            lambda: [
+                merged(
+                    legacyAnalyse(d, theKey, instead=instead, full=full) for d in docs
+                )
+            ],
+            lambda: [merged(analyseKeys(d, [spec])[0] for d in docs)],
+        )
+
+    compare(
+        "all keys together",
+        rounds,
+        lambda: [
+            merged(
+                legacyAnalyse(d, theKey, instead=instead, full=full) for d in docs
+            )
+            for (theKey, instead, full) in specs
+        ],
+        lambda: [
+            merged(inventories)
+            for inventories in zip(*(analyseKeys(d, specs) for d in docs))
+        ],
+    )
+
+    compare(
+        "filter leaves",
+        rounds,
+        lambda: [legacyFilter(d, exclude={"text"}) for d in docs],
+        lambda: [filter(d, exclude={"text"}) for d in docs],
+    )
+
+
+command = None if len(sys.argv) <= 1 else sys.argv[1]
+
+if command is None:
+    main(ROUNDS)
+elif command.isdigit():
+    main(int(command))
+else:
+    msg(f"Wrong command {command} !\n{HELP}")
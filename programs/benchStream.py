@@ -0,0 +1,110 @@
+import sys
+import os
+import json
+import time
+import resource
+import subprocess
+
+from jsonSource import getJsonFiles, readJsonFile, streamJsonFile
+from tokenFromJson import SRC_DIR, TEMP_DIR
+
+HELP = """
+python3 benchStream.py
+    Measure peak memory of reading the JSON sources completely and as a stream,
+    for the current corpus and for a corpus with a 100 times inflated tablet
+python3 benchStream.py factor
+    Same, but inflate the biggest tablet by factor instead of 100
+
+Every measurement runs in a fresh process, because peak memory cannot be reset.
+"""
+
+FACTOR = 100
+INFLATED_DIR = f"{TEMP_DIR}/inflated"
+META_KEYS = {"cdliNumber", "number", "museum", "collection", "description"}
+
+
+def msg(m):
+    sys.stdout.write(f"{m}\n")
+
+
+def peakRss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def makeInflated(factor):
+    paths = getJsonFiles(SRC_DIR)
+    biggest = max(paths, key=lambda path: os.path.getsize(path))
+    data = readJsonFile(biggest)
+    lines = data["text"]["allLines"]
+    data["text"]["allLines"] = lines * factor
+
+    os.makedirs(INFLATED_DIR, exist_ok=True)
+    fileName = biggest.split("/")[-1]
+    inflatedPath = f"{INFLATED_DIR}/{fileName}"
+    with open(inflatedPath, "w") as fh:
+        json.dump(data, fh, ensure_ascii=False)
+    return inflatedPath
+
+
+def child(mode, paths):
+    startRss = peakRss()
+    start = time.perf_counter()
+    nLines = 0
+
+    for path in paths:
+        if mode == "stream":
+            (header, lines) = streamJsonFile(path, META_KEYS)
+        else:
+            data = readJsonFile(path)
+            lines = data["text"]["allLines"]
+        for line in lines:
+            nLines += 1
+        lines = None
+        data = None
+
+    result = dict(
+        lines=nLines,
+        seconds=time.perf_counter() - start,
+        startKb=startRss,
+        peakKb=peakRss(),
+    )
+    sys.stdout.write(json.dumps(result))
+
+
+def measure(mode, label, paths):
+    result = subprocess.run(
+        [sys.executable, __file__, "-child", mode, *paths],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    info = json.loads(result.stdout)
+    size = sum(os.path.getsize(path) for path in paths) // 1024
+    growth = info["peakKb"] - info["startKb"]
+    msg(
+        f"{label:<10} {mode:<6} {size:>9} KB json {info['lines']:>8} lines "
+        f"{info['seconds']:>6.2f}s peak {info['peakKb']:>8} KB (+{growth:>7} KB)"
+    )
+
+
+def main(factor):
+    corpus = getJsonFiles(SRC_DIR)
+    inflated = [makeInflated(factor)]
+
+    for (label, paths) in (("corpus", corpus), (f"{factor}x", inflated)):
+        for mode in ("load", "stream"):
+            measure(mode, label, paths)
+
+
+command = None if len(sys.argv) <= 1 else sys.argv[1]
+
+if command == "-child":
+    child(sys.argv[2], sys.argv[3:])
+elif command is None:
+    main(FACTOR)
+elif command.isdigit():
+    main(int(command))
+else:
+    msg(f"Wrong command {command} !\n{HELP}")
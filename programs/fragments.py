@@ -0,0 +1,174 @@
+import os
+import pickle
+import hashlib
+
+# FRAGMENT CACHE
+#
+# When tfFromJson converts a document, it can record everything the director asks
+# of the walker for that document: which nodes and slots it creates,
+# which features it assigns, and when it terminates nodes.
+# Such a recording is a fragment.
+#
+# Nodes in a fragment are local: they are numbered in the order in which they have
+# been created within the document.
+# When a fragment is replayed on a walker, the walker hands out fresh node numbers,
+# so the fragment can be spliced into any position of the corpus.
+#
+# Fragments are stored per document, keyed by a hash of the source file and of the
+# converter, so that a change in either invalidates the fragment.
+# Fragments of changed documents are not overwritten but become unreachable;
+# `Fragments.prune()` cleans them up.
+
+NODE = 0
+SLOT = 1
+TERMINATE = 2
+FEATURE = 3
+
+EXT = ".fragment"
+TMP = ".tmp"
+
+
+def fileHash(path, salt=""):
+    h = hashlib.sha256(salt.encode("utf8"))
+    with open(path, "rb") as fh:
+        h.update(fh.read())
+    return h.hexdigest()
+
+
+class RecordingCV:
+    """Passes all calls on to a walker, and optionally records them.
+
+    Between `start()` and `stop()` the node creating and feature assigning calls
+    are recorded as a fragment.
+    If the director refers to a node that has been created outside the recording,
+    the fragment cannot be replayed in isolation, and `stop()` returns `None`.
+    """
+
+    def __init__(self, cv):
+        self.cv = cv
+        self.ops = None
+        self.local = None
+        self.sound = True
+
+    def __getattr__(self, name):
+        return getattr(self.cv, name)
+
+    def start(self):
+        self.ops = []
+        self.local = {}
+        self.sound = True
+
+    def stop(self):
+        ops = self.ops if self.sound else None
+        self.ops = None
+        self.local = None
+        return ops
+
+    def _localNode(self, node):
+        local = self.local.get(node, None)
+        if local is None:
+            self.sound = False
+        return local
+
+    def node(self, nType):
+        node = self.cv.node(nType)
+        if self.ops is not None:
+            self.local[node] = len(self.local)
+            self.ops.append((NODE, nType))
+        return node
+
+    def slot(self):
+        node = self.cv.slot()
+        if self.ops is not None:
+            self.local[node] = len(self.local)
+            self.ops.append((SLOT,))
+        return node
+
+    def terminate(self, node):
+        if self.ops is not None:
+            self.ops.append((TERMINATE, self._localNode(node)))
+        return self.cv.terminate(node)
+
+    def feature(self, node, **features):
+        if self.ops is not None:
+            self.ops.append((FEATURE, self._localNode(node), features))
+        return self.cv.feature(node, **features)
+
+
+def replay(cv, ops):
+    nodes = []
+
+    for op in ops:
+        kind = op[0]
+        if kind == NODE:
+            nodes.append(cv.node(op[1]))
+        elif kind == SLOT:
+            nodes.append(cv.slot())
+        elif kind == TERMINATE:
+            cv.terminate(nodes[op[1]])
+        elif kind == FEATURE:
+            cv.feature(nodes[op[1]], **op[2])
+
+
+class Fragments:
+    """A directory of fragments, one file per distinct source document.
+
+    Fragment files are named after the key of the document,
+    so a fragment is fresh if and only if its file exists.
+    If `hashOf` is given, it should deliver the content hash of a source file,
+    e.g. from a manifest, so that the file itself does not have to be read.
+    """
+
+    def __init__(self, location, salt="", hashOf=None):
+        self.location = location
+        self.salt = salt
+        self.hashOf = hashOf
+        self.keys = {}
+        self.seen = set()
+        os.makedirs(location, exist_ok=True)
+
+    def _path(self, path):
+        key = self.keys.get(path, None)
+        if key is None:
+            hashOf = self.hashOf
+            salt = self.salt
+            if hashOf is None:
+                key = fileHash(path, salt=salt)
+            else:
+                key = hashlib.sha256(f"{salt}:{hashOf(path)}".encode("utf8"))
+                key = key.hexdigest()
+            self.keys[path] = key
+        self.seen.add(key)
+        return f"{self.location}/{key}{EXT}"
+
+    def has(self, path):
+        return os.path.exists(self._path(path))
+
+    def get(self, path):
+        fragmentPath = self._path(path)
+        if not os.path.exists(fragmentPath):
+            return None
+        with open(fragmentPath, "rb") as fh:
+            return pickle.load(fh)
+
+    def put(self, path, ops, **info):
+        """Store a fragment; an interrupted write does not leave a truncated one."""
+        fragment = dict(ops=ops, **info)
+        fragmentPath = self._path(path)
+        tmpPath = f"{fragmentPath}{TMP}"
+        with open(tmpPath, "wb") as fh:
+            pickle.dump(fragment, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, fragmentPath)
+
+    def prune(self):
+        """Remove the fragments of documents that have not been seen in this run.
+
+        Also remove the leftovers of interrupted writes.
+        """
+        with os.scandir(self.location) as it:
+            for entry in it:
+                name = entry.name
+                if name.endswith(TMP) or (
+                    name.endswith(EXT) and name[0 : -len(EXT)] not in self.seen
+                ):
+                    os.unlink(entry.path)
@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import cProfile
+import pstats
+import tracemalloc
+from collections import defaultdict
+
+# INSTRUMENTATION OF THE CONVERSION
+#
+# When tfFromJson runs with `-profile`, the director reports to an instrument:
+#
+# *   which document it starts and which line type it processes: the time until the
+#     next document or line counts for this document or line type (lap timing);
+# *   every call of `doSign` and `doCluster`, and every `cv.feature` and `cv.get`:
+#     these functions are wrapped in timers, that count the calls and add up the
+#     time per category: the sign type, the cluster transition, the cv method.
+#
+# Timers are inclusive: the time of a sign includes the clusters and the features
+# it causes.
+# The walk as a whole can be captured by cProfile and tracemalloc.
+# The results go to a JSON report and to a table of the top entries.
+#
+# When not enabled, the instrument does not wrap anything, and its lap methods
+# return immediately.
+
+TOP = 10
+
+CLUSTER_STATUS = {True: "open", False: "close", None: "continue"}
+
+
+def signCategory(result, data, *args, **kwargs):
+    return f"sign:{data['type']}"
+
+
+def clusterCategory(result, data, cluster, *args, **kwargs):
+    return f"cluster:{cluster}:{CLUSTER_STATUS[result]}"
+
+
+class CountingCV:
+    """Passes all calls on to a walker, and times `feature()` and `get()`."""
+
+    def __init__(self, cv, instrument):
+        self.cv = cv
+        self.feature = instrument.timed(
+            cv.feature, lambda result, *args, **kwargs: "cv.feature"
+        )
+        self.get = instrument.timed(cv.get, lambda result, *args, **kwargs: "cv.get")
+
+    def __getattr__(self, name):
+        return getattr(self.cv, name)
+
+
+class Instrument:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counts = defaultdict(int)
+        self.times = defaultdict(float)
+        self.documents = []
+        self.curDoc = None
+        self.curLine = None
+        self.profile = None
+        self.memory = None
+
+    # lap timing of documents and lines
+
+    def _endLine(self, now):
+        if self.curLine is not None:
+            (key, start) = self.curLine
+            self.counts[key] += 1
+            self.times[key] += now - start
+            self.curLine = None
+
+    def _endDocument(self, now):
+        if self.curDoc is not None:
+            self.curDoc["seconds"] = now - self.curDoc.pop("start")
+            self.curDoc = None
+
+    def document(self, name, replayed=False):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self._endLine(now)
+        self._endDocument(now)
+        self.curDoc = dict(name=name, replayed=replayed, lines=0, signs=0, start=now)
+        self.documents.append(self.curDoc)
+
+    def line(self, lineType):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self._endLine(now)
+        self.curLine = (f"line:{lineType}", now)
+        if self.curDoc is not None:
+            self.curDoc["lines"] += 1
+
+    def done(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self._endLine(now)
+        self._endDocument(now)
+
+    # timers
+
+    def timed(self, function, category, unit=None):
+        """Wrap a function in a timer.
+
+        `category(result, *args, **kwargs)` gives the key under which the call
+        is counted; if `unit` is given, the call is also counted under that name
+        for the current document.
+        """
+        if not self.enabled:
+            return function
+
+        counts = self.counts
+        times = self.times
+        clock = time.perf_counter
+
+        def wrapped(*args, **kwargs):
+            start = clock()
+            result = function(*args, **kwargs)
+            key = category(result, *args, **kwargs)
+            counts[key] += 1
+            times[key] += clock() - start
+            if unit is not None and self.curDoc is not None:
+                self.curDoc[unit] += 1
+            return result
+
+        return wrapped
+
+    def wrapCv(self, cv):
+        return CountingCV(cv, self) if self.enabled else cv
+
+    # capturing cProfile and tracemalloc
+
+    def capture(self, function, *args, **kwargs):
+        """Run a function under cProfile and tracemalloc, if enabled."""
+        if not self.enabled:
+            return function(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        tracemalloc.start()
+        profiler.enable()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            (current, peak) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        stats = pstats.Stats(profiler).stats
+        functions = sorted(stats.items(), key=lambda x: -x[1][2])[0:TOP]
+        self.profile = [
+            dict(
+                function=f"{os.path.basename(file)}:{line}({name})",
+                calls=nCalls,
+                tottime=round(tottime, 4),
+                cumtime=round(cumtime, 4),
+            )
+            for ((file, line, name), (cc, nCalls, tottime, cumtime, callers)) in (
+                functions
+            )
+        ]
+        self.memory = dict(
+            peakKb=peak // 1024,
+            top=[
+                dict(
+                    where=(
+                        f"{os.path.basename(stat.traceback[0].filename)}:"
+                        f"{stat.traceback[0].lineno}"
+                    ),
+                    sizeKb=stat.size // 1024,
+                    count=stat.count,
+                )
+                for stat in snapshot.statistics("lineno")[0:TOP]
+            ],
+        )
+        return result
+
+    # reporting
+
+    def categories(self):
+        return {
+            key: dict(
+                count=self.counts[key],
+                seconds=round(self.times[key], 4),
+                perCallUs=round(1e6 * self.times[key] / self.counts[key], 2),
+            )
+            for key in sorted(self.counts, key=lambda k: -self.times[k])
+        }
+
+    def report(self):
+        documents = [
+            dict(doc, seconds=round(doc.get("seconds", 0), 4)) for doc in self.documents
+        ]
+        return dict(
+            documents=documents,
+            categories=self.categories(),
+            profile=self.profile,
+            memory=self.memory,
+        )
+
+    def writeReport(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fh:
+            json.dump(self.report(), fh, ensure_ascii=False, indent=1)
+            fh.write("\n")
+
+    def table(self, n=TOP):
+        """The top n of slowest documents, categories and functions, as lines."""
+        lines = []
+
+        lines.append(f"Slowest {n} tablets")
+        slowest = sorted(self.documents, key=lambda doc: -doc.get("seconds", 0))
+        for doc in slowest[0:n]:
+            replayRep = " (unchanged)" if doc["replayed"] else ""
+            lines.append(
+                f"{doc.get('seconds', 0):>8.3f}s {doc['lines']:>5} lines "
+                f"{doc['signs']:>6} signs {doc['name']}{replayRep}"
+            )
+
+        lines.append(f"Most expensive {n} sign categories")
+        categories = self.categories()
+        signs = [key for key in categories if key.startswith("sign:")]
+        for key in signs[0:n]:
+            info = categories[key]
+            lines.append(
+                f"{info['seconds']:>8.3f}s {info['count']:>7} x "
+                f"{info['perCallUs']:>7.2f}us {key}"
+            )
+
+        lines.append(f"Most expensive {n} other categories")
+        others = [key for key in categories if not key.startswith("sign:")]
+        for key in others[0:n]:
+            info = categories[key]
+            lines.append(
+                f"{info['seconds']:>8.3f}s {info['count']:>7} x "
+                f"{info['perCallUs']:>7.2f}us {key}"
+            )
+
+        if self.profile:
+            lines.append(f"Top {n} functions by own time")
+            for info in self.profile[0:n]:
+                lines.append(
+                    f"{info['cumtime']:>8.3f}s {info['tottime']:>8.3f}s own "
+                    f"{info['calls']:>8} calls {info['function']}"
+                )
+
+        if self.memory:
+            lines.append(
+                f"Top {n} allocations, peak traced memory {self.memory['peakKb']} KB"
+            )
+            for info in self.memory["top"][0:n]:
+                lines.append(
+                    f"{info['sizeKb']:>8} KB {info['count']:>8} blocks {info['where']}"
+                )
+
+        return lines
@@ -0,0 +1,254 @@
+import collections
+
+# COMPILED PATH QUERIES
+#
+# The walkers in tokenFromJson identify a value by its path in the JSON tree,
+# e.g. `text.allLines[].content[].parts[].flags`.
+# A path consists of tokens: keys of objects and `[]` for the items of lists.
+#
+# A PathQuery looks for several keys at once.
+# A key matches a path if the tokens of the key are the last tokens of the path,
+# so `flags` matches the path above, and so does `parts[].flags`.
+# The keys are compiled into an Aho-Corasick automaton over tokens, and during the
+# walk only the state of the automaton is passed down, not the path itself.
+# Paths are only rendered as strings when a match is emitted.
+#
+# Skip paths are complete paths from the top, e.g. `folios`.
+# They are compiled into a trie, and the walk does not enter them.
+
+LIST = "[]"
+
+
+def tokenize(path):
+    tokens = []
+    for part in path.split("."):
+        nLists = 0
+        while part.endswith(LIST):
+            part = part[0 : -len(LIST)]
+            nLists += 1
+        if part:
+            tokens.append(part)
+        tokens.extend([LIST] * nLists)
+    return tuple(tokens)
+
+
+def extend(path, token):
+    if token == LIST:
+        return f"{path}{LIST}" if path else path
+    return f"{path}.{token}" if path else token
+
+
+class PathQuery:
+    """Find several keys in a JSON tree in a single walk.
+
+    `keys` is a sequence of keys; matches are reported by the position of the key
+    in this sequence.
+    `skip` is a collection of paths from the top that are not entered.
+    `exempt` contains the positions of keys that should also be looked for
+    inside the skipped paths.
+
+    A key that matches a value is not looked for inside that value;
+    when no keys are left to look for, the walk does not descend any further.
+    """
+
+    def __init__(self, keys, skip=(), exempt=()):
+        self.keys = tuple(keys)
+        nKeys = len(self.keys)
+        self.allMask = (1 << nKeys) - 1
+        self.exemptMask = sum(1 << i for i in set(exempt))
+        self._compileKeys()
+        self._compileSkip(skip)
+
+    def _compileKeys(self):
+        goto = [{}]
+        out = [0]
+
+        for (i, key) in enumerate(self.keys):
+            state = 0
+            for token in tokenize(key):
+                nextState = goto[state].get(token, None)
+                if nextState is None:
+                    nextState = len(goto)
+                    goto.append({})
+                    out.append(0)
+                    goto[state][token] = nextState
+                state = nextState
+            out[state] |= 1 << i
+
+        fail = [0] * len(goto)
+        queue = collections.deque(goto[0].values())
+
+        while queue:
+            state = queue.popleft()
+            for (token, nextState) in goto[state].items():
+                queue.append(nextState)
+                f = fail[state]
+                while f and token not in goto[f]:
+                    f = fail[f]
+                f = goto[f].get(token, 0)
+                fail[nextState] = f if f != nextState else 0
+                out[nextState] |= out[fail[nextState]]
+
+        self.goto = goto
+        self.fail = fail
+        self.out = out
+
+    def _compileSkip(self, skip):
+        trie = {}
+        for path in skip:
+            node = trie
+            for token in tokenize(path):
+                node = node.setdefault(token, {})
+            node[None] = True
+        self.skipTrie = trie if trie else None
+
+    def _step(self, state, token):
+        goto = self.goto
+        fail = self.fail
+        while True:
+            nextState = goto[state].get(token, None)
+            if nextState is not None:
+                return nextState
+            if state == 0:
+                return 0
+            state = fail[state]
+
+    def run(self, data, emit):
+        """Walk through data and call `emit(i, path, value, parent)` for every match.
+
+        `i` is the position of the matching key.
+        Members of objects are visited in the order of their keys.
+        """
+        out = self.out
+        exemptMask = self.exemptMask
+        step = self._step
+        tokens = []
+
+        # paths[d] is the rendered path of the first d tokens, if it has been needed
+
+        paths = [""]
+
+        def getPath():
+            d = len(tokens)
+            while paths[d] is None:
+                d -= 1
+            path = paths[d]
+            for e in range(d, len(tokens)):
+                path = extend(path, tokens[e])
+                paths[e + 1] = path
+            return path
+
+        def push(token):
+            tokens.append(token)
+            paths.append(None)
+
+        def pop():
+            tokens.pop()
+            paths.pop()
+
+        def walk(info, parent, state, skipNode, active):
+            if skipNode is not None and None in skipNode:
+                active &= exemptMask
+                if not active:
+                    return
+
+            matched = out[state] & active
+            if matched:
+                path = getPath()
+                i = 0
+                bits = matched
+                while bits:
+                    if bits & 1:
+                        emit(i, path, info, parent)
+                    bits >>= 1
+                    i += 1
+                active &= ~matched
+                if not active:
+                    return
+
+            tp = type(info)
+            if tp is dict:
+                for (k, v) in sorted(info.items()):
+                    push(k)
+                    walk(
+                        v,
+                        info,
+                        step(state, k),
+                        None if skipNode is None else skipNode.get(k, None),
+                        active,
+                    )
+                    pop()
+            elif tp is list:
+                # the items of a list at the top have the same path as the list
+
+                inside = len(tokens) > 0
+                if inside:
+                    state = step(state, LIST)
+                    skipNode = None if skipNode is None else skipNode.get(LIST, None)
+                    push(LIST)
+                for v in info:
+                    walk(v, info, state, skipNode, active)
+                if inside:
+                    pop()
+
+        walk(data, {}, 0, self.skipTrie, self.allMask)
+
+    def leaves(self, data, emit, indices=False):
+        """Walk through data and call `emit(path, value)` for every leaf.
+
+        The keys of the query play no role, only the skip paths.
+        If `indices`, list items show up in paths as `[0]`, `[1]`, etc.
+        The path of every value is rendered when the walk enters it, from the path of
+        its parent, so a leaf costs a single extension of a path.
+        Below the skip paths, a walk without skip bookkeeping takes over.
+        """
+
+        def plain(info, path):
+            tp = type(info)
+            if tp is dict:
+                for (k, v) in sorted(info.items()):
+                    plain(v, f"{path}.{k}" if path else k)
+            elif tp is list:
+                # the items of a list at the top have the same path as the list
+
+                if not path:
+                    for v in info:
+                        plain(v, path)
+                elif indices:
+                    for (k, v) in enumerate(info):
+                        plain(v, f"{path}[{k}]")
+                else:
+                    itemPath = f"{path}{LIST}"
+                    for v in info:
+                        plain(v, itemPath)
+            else:
+                emit(path, info)
+
+        def walk(info, path, skipNode):
+            if skipNode is None:
+                plain(info, path)
+                return
+            if None in skipNode:
+                return
+
+            tp = type(info)
+            if tp is dict:
+                for (k, v) in sorted(info.items()):
+                    walk(v, f"{path}.{k}" if path else k, skipNode.get(k, None))
+            elif tp is list:
+                if not path:
+                    for v in info:
+                        walk(v, path, skipNode)
+                    return
+                skipNode = skipNode.get(LIST, None)
+                if indices:
+                    for (k, v) in enumerate(info):
+                        walk(v, f"{path}[{k}]", skipNode)
+                else:
+                    itemPath = f"{path}{LIST}"
+                    for v in info:
+                        walk(v, itemPath, skipNode)
+            else:
+                emit(path, info)
+
+        walk(data, "", self.skipTrie)
@@ -0,0 +1,487 @@
+import os
+import re
+import sys
+import json
+import marshal
+import hashlib
+import collections
+from itertools import islice
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+# READING THE eBL JSON SOURCES
+#
+# Shared by tfFromJson.py and tokenFromJson.py.
+# The functions here do not depend on the configuration of either program,
+# everything they need is passed as arguments.
+
+# Number of decoded documents per worker that may be waiting for the consumer.
+# This caps the amount of decoded JSON that is held in memory.
+
+AHEAD_PER_WORKER = 2
+
+
+def getJsonFiles(srcDir):
+    filePaths = []
+
+    def walk(path):
+        with os.scandir(path) as it:
+            for entry in it:
+                name = entry.name
+                if not name.startswith(".") and entry.is_dir():
+                    walk(f"{path}/{name}")
+                elif name.endswith(".json") and entry.is_file:
+                    filePaths.append(f"{path}/{name}")
+
+    walk(srcDir)
+    return sorted(filePaths)
+
+
+def readJsonFile(path, keys=None):
+    with open(path) as fh:
+        data = json.load(fh)
+    if keys is not None:
+        data = {k: v for (k, v) in data.items() if k in keys}
+    return data
+
+
+# STREAMING
+#
+# A tablet is a big JSON object of which the converters need only a few metadata
+# fields and the list `text.allLines`.
+# A JsonStream reads a JSON file in chunks and lets the caller decide, value by value,
+# whether to decode it or to skip it.
+# Skipping descends a few levels into a value and decodes and discards its parts
+# one by one; for a tablet those are single lines, folios, references.
+# So the memory needed depends on the size of the biggest part,
+# not on the size of the file.
+
+STREAM_CHUNK = 1 << 16
+SKIP_DEPTH = 2
+
+WS_RE = re.compile(r"[ \t\n\r]*")
+
+DECODER = json.JSONDecoder()
+
+
+class JsonStream:
+    """Pull parser on top of a text file handle.
+
+    Iterate over `members()` of an object or over `items()` of an array,
+    and consume every member or item with `value()` or `skip()`,
+    or by descending into it with `members()` or `items()`.
+    """
+
+    def __init__(self, fh, chunkSize=STREAM_CHUNK):
+        self.fh = fh
+        self.chunkSize = chunkSize
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        if self.eof:
+            return False
+
+        # if a big value is pending, the chunks grow, to prevent quadratic behaviour
+
+        buf = self.buf[self.pos :]
+        chunk = self.fh.read(max(self.chunkSize, len(buf)))
+        self.buf = buf + chunk
+        self.pos = 0
+        if not chunk:
+            self.eof = True
+            return False
+        return True
+
+    def _error(self, m):
+        raise ValueError(f"JSON stream: {m} in {getattr(self.fh, 'name', '')}")
+
+    def _peek(self):
+        while True:
+            self.pos = WS_RE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, chars):
+        c = self._peek()
+        if not c or c not in chars:
+            self._error(f"expected one of {chars!r} but found {c!r}")
+        self.pos += 1
+        return c
+
+    def value(self):
+        self._peek()
+        while True:
+            try:
+                (value, end) = DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+
+            # a number or literal at the end of the buffer might continue
+
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def skip(self, depth=SKIP_DEPTH):
+        c = self._peek()
+        if depth == 0 or (c != "{" and c != "["):
+            self.value()
+        elif c == "{":
+            for _ in self.members():
+                self.skip(depth=depth - 1)
+        else:
+            for _ in self.items():
+                self.skip(depth=depth - 1)
+
+    def members(self):
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self._expect(":")
+            yield key
+            if self._expect(",}") == "}":
+                return
+
+    def items(self):
+        self._expect("[")
+        if self._peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self._expect(",]") == "]":
+                return
+
+
+def readJsonHeader(path, keys):
+    """Decode the values of the given top-level keys, skip all other values."""
+    keys = set(keys)
+    header = {}
+
+    with open(path) as fh:
+        stream = JsonStream(fh)
+        for key in stream.members():
+            if key in keys:
+                header[key] = stream.value()
+                if len(header) == len(keys):
+                    break
+            else:
+                stream.skip()
+
+    return header
+
+
+def streamJsonItems(path, trail=("text", "allLines")):
+    """Yield the items of the array found by following `trail` from the top."""
+
+    def descend(stream, trail):
+        if not trail:
+            for _ in stream.items():
+                yield stream.value()
+            return
+
+        for key in stream.members():
+            if key == trail[0]:
+                yield from descend(stream, trail[1:])
+                return
+            stream.skip()
+
+    with open(path) as fh:
+        yield from descend(JsonStream(fh), trail)
+
+
+def streamJsonFile(path, keys, trail=("text", "allLines")):
+    """Read a document as a header and a lazy stream of lines.
+
+    The metadata of a tablet may come after its text, so the file is read twice:
+    once for the values of `keys`, and once, lazily, for the items under `trail`.
+    """
+    return (readJsonHeader(path, keys), streamJsonItems(path, trail=trail))
+
+
+def poolSize(nPaths, workers=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    return max(min(workers, nPaths), 1)
+
+
+def mapFiles(function, paths, workers=None, ahead=None, initializer=None, initargs=()):
+    """Apply a function to files in a process pool, deliver results in the given order.
+
+    Yields tuples `(path, result)`.
+    The work runs ahead of the consumer, but never more than `ahead` files;
+    the default is `AHEAD_PER_WORKER` files per worker.
+    The function must be picklable, i.e. defined at the top level of a module.
+    It is shipped with every file, so it should be small; state that the function
+    needs can be set up once per worker by `initializer(*initargs)`.
+    With a single worker or a single file, no pool is started,
+    and the initializer runs in the current process.
+    """
+    paths = list(paths)
+    workers = poolSize(len(paths), workers=workers)
+    if ahead is None:
+        ahead = AHEAD_PER_WORKER * workers
+    ahead = max(ahead, 1)
+
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for path in paths:
+            yield (path, function(path))
+        return
+
+    pool = ProcessPoolExecutor(
+        max_workers=workers, initializer=initializer, initargs=initargs
+    )
+    todo = iter(paths)
+    pending = collections.deque(
+        (path, pool.submit(function, path)) for path in islice(todo, ahead)
+    )
+
+    try:
+        while pending:
+            (path, future) = pending.popleft()
+            result = future.result()
+            for nextPath in islice(todo, 1):
+                pending.append((nextPath, pool.submit(function, nextPath)))
+            yield (path, result)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+# the parse cache of a worker process, handed over once when the worker starts,
+# so that its stamps of all files are not shipped with every file
+
+workerCache = None
+
+
+def setWorkerCache(cache):
+    global workerCache
+    workerCache = cache
+
+
+def readCached(path, keys=None):
+    return workerCache.read(path, keys=keys)
+
+
+def readJsonFiles(paths, keys=None, workers=None, ahead=None, cache=None):
+    """Decode JSON files in a process pool, deliver them in the given order.
+
+    Yields tuples `(path, data)`, see `mapFiles()`.
+    If `keys` is given, only those top-level keys are kept, which saves memory and
+    the cost of shipping the data back from the workers.
+    If a `ParseCache` is given, documents are read through it.
+    """
+    keys = None if keys is None else set(keys)
+    if cache is None:
+        return mapFiles(
+            partial(readJsonFile, keys=keys), paths, workers=workers, ahead=ahead
+        )
+    return mapFiles(
+        partial(readCached, keys=keys),
+        paths,
+        workers=workers,
+        ahead=ahead,
+        initializer=setWorkerCache,
+        initargs=(cache,),
+    )
+
+
+# MANIFEST
+#
+# The manifest is a persisted index of a source directory.
+# Per JSON file it records the P-number, the museum number, the size,
+# the modification time, the hash and the number of lines.
+# It also records the modification times of the directories, so that directories
+# whose listing has not changed are not scanned again.
+# Entries are only recomputed for files whose size or modification time has changed.
+
+
+class Manifest:
+    def __init__(self, srcDir, location):
+        self.srcDir = srcDir
+        self.location = location
+        self.dirs = {}
+        self.files = {}
+        self.changed = False
+
+        if os.path.exists(location):
+            with open(location) as fh:
+                stored = json.load(fh)
+            if stored.get("srcDir", None) == srcDir:
+                self.dirs = stored["dirs"]
+                self.files = stored["files"]
+
+        self.update()
+
+    def _scanDir(self, rel, dirs):
+        srcDir = self.srcDir
+        path = f"{srcDir}/{rel}" if rel else srcDir
+        mtime = os.stat(path).st_mtime_ns
+        info = self.dirs.get(rel, None)
+
+        if info is None or info["mtime"] != mtime:
+            subDirs = []
+            files = []
+            with os.scandir(path) as it:
+                for entry in it:
+                    name = entry.name
+                    relName = f"{rel}/{name}" if rel else name
+                    if not name.startswith(".") and entry.is_dir():
+                        subDirs.append(relName)
+                    elif name.endswith(".json") and entry.is_file:
+                        files.append(relName)
+            info = dict(mtime=mtime, dirs=sorted(subDirs), files=sorted(files))
+            self.changed = True
+
+        dirs[rel] = info
+        for subDir in info["dirs"]:
+            self._scanDir(subDir, dirs)
+
+    def _scanFile(self, rel):
+        path = f"{self.srcDir}/{rel}"
+        stat = os.stat(path)
+        size = stat.st_size
+        mtime = stat.st_mtime_ns
+        info = self.files.get(rel, None)
+
+        if info is not None and info["size"] == size and info["mtime"] == mtime:
+            return info
+
+        with open(path, "rb") as fh:
+            text = fh.read()
+        data = json.loads(text)
+        self.changed = True
+        return dict(
+            pnumber=data.get("cdliNumber", None),
+            number=data.get("number", None),
+            size=size,
+            mtime=mtime,
+            hash=hashlib.sha256(text).hexdigest(),
+            lines=len(data.get("text", {}).get("allLines", [])),
+        )
+
+    def update(self):
+        dirs = {}
+        self._scanDir("", dirs)
+        if set(dirs) != set(self.dirs):
+            self.changed = True
+        self.dirs = dirs
+
+        files = {}
+        for info in dirs.values():
+            for rel in info["files"]:
+                files[rel] = self._scanFile(rel)
+        if set(files) != set(self.files):
+            self.changed = True
+        self.files = files
+
+        if self.changed:
+            self.save()
+            self.changed = False
+
+    def save(self):
+        location = self.location
+        os.makedirs(os.path.dirname(location), exist_ok=True)
+        tmpLocation = f"{location}.tmp"
+        with open(tmpLocation, "w") as fh:
+            json.dump(
+                dict(srcDir=self.srcDir, dirs=self.dirs, files=self.files),
+                fh,
+                ensure_ascii=False,
+                indent=1,
+            )
+        os.replace(tmpLocation, location)
+
+    def paths(self):
+        srcDir = self.srcDir
+        return sorted(f"{srcDir}/{rel}" for rel in self.files)
+
+    def entry(self, path):
+        return self.files.get(os.path.relpath(path, self.srcDir), None)
+
+    def find(self, pnumber):
+        return [path for path in self.paths() if self.entry(path)["pnumber"] == pnumber]
+
+
+# PARSE CACHE
+#
+# Most of a tablet consists of material that the converters do not use.
+# The parse cache stores, per tablet, only the top-level values in `CACHE_KEYS`,
+# in marshal format, which loads much faster than JSON.
+# A cached tablet is valid as long as the hash of its source file is the same as
+# when it was cached; the manifest recomputes that hash whenever the modification
+# time of the source file changes.
+# Marshal data is specific to the Python version, so that is part of the validity
+# check as well.
+
+CACHE_KEYS = frozenset(
+    """
+    cdliNumber
+    collection
+    description
+    museum
+    number
+    publication
+    text
+""".strip().split()
+)
+
+CACHE_EXT = ".marshal"
+
+
+class ParseCache:
+    def __init__(self, location, manifest):
+        self.location = location
+        self.pyVersion = "{}.{}".format(*sys.version_info[0:2])
+        self.refresh(manifest)
+        os.makedirs(location, exist_ok=True)
+
+    def refresh(self, manifest):
+        """Take over the current hashes from an updated manifest."""
+        srcDir = manifest.srcDir
+        self.stamps = {
+            f"{srcDir}/{rel}": (rel, info["hash"])
+            for (rel, info) in manifest.files.items()
+        }
+
+    def read(self, path, keys=None):
+        """Read a projected document, from the cache if possible.
+
+        Only keys in `CACHE_KEYS` are available; `keys` may narrow that down.
+        Files that are not in the manifest are read from source and not cached.
+        """
+        stamp = self.stamps.get(path, None)
+        if stamp is None:
+            return readJsonFile(path, keys=CACHE_KEYS if keys is None else keys)
+
+        (rel, fileHash) = stamp
+        cachePath = f"{self.location}/{rel.replace('/', '~')}{CACHE_EXT}"
+        data = None
+
+        if os.path.exists(cachePath):
+            with open(cachePath, "rb") as fh:
+                (cachedStamp, cachedData) = marshal.loads(fh.read())
+            if cachedStamp == (self.pyVersion, fileHash):
+                data = cachedData
+
+        if data is None:
+            data = readJsonFile(path, keys=CACHE_KEYS)
+            tmpPath = f"{cachePath}.{os.getpid()}"
+            with open(tmpPath, "wb") as fh:
+                marshal.dump(((self.pyVersion, fileHash), data), fh)
+            os.replace(tmpPath, cachePath)
+
+        if keys is not None:
+            data = {k: v for (k, v) in data.items() if k in keys}
+        return data
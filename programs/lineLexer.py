@@ -0,0 +1,73 @@
+# A LEXER FOR THE CONTENT OF TEXT LINES
+#
+# The content of a text line in eBL JSON is a tree: a list of words and other
+# tokens, where words have parts, and parts may be determinatives with parts of
+# their own, or variants with tokens of their own.
+#
+# `lexLine()` turns such a tree into a flat stream of tokens, in reading order.
+# A token is a plain tuple (kind, data, isLast, group, index, atEnd, part):
+#
+# *   WORD: a word, i.e. a top-level content element with parts;
+#     `isLast` tells whether it is the last word of the line;
+# *   SIGN: a part of a word, or a part of a determinative or variant in a word;
+#     `isLast` tells whether it is the last sign of its word;
+#     for parts of determinatives and variants, `group` is "Determinative" or
+#     "Variant", `part` is the determinative or variant, `index` the position in
+#     it and `atEnd` whether it is the last in it;
+# *   OTHER: a top-level element without parts, such as a language shift or a
+#     word divider.
+#
+# A part of a word is a determinative if it has parts, otherwise a variant if it
+# has tokens, otherwise a sign.
+#
+# The stream is lazy and made in one forward pass: every token is known to be last
+# or not when it is made.
+# A sign is the last of its word if it is the last one of the last part that has
+# signs; that is nearly always the last part, so the parts of a word are only
+# scanned backwards as far as needed. That part is recognized by identity: every
+# part is a dict of its own.
+# In the same way, the last word of the line is found by a backward scan over the
+# top-level elements, which usually stops at the very last one.
+#
+# This is a restructuring, not a speedup: the lexer runs at about the same speed as
+# the list with two backward passes over it that the director used before, see
+# benchLexer.py.
+
+(WORD, SIGN, OTHER) = range(3)
+
+
+def lexLine(content):
+    """Generate the tokens of the content of a line, see above."""
+    lastWord = len(content) - 1
+    while lastWord >= 0 and "parts" not in content[lastWord]:
+        lastWord -= 1
+
+    for (i, element) in enumerate(content):
+        if "parts" not in element:
+            yield (OTHER, element, False, None, None, None, None)
+            continue
+
+        yield (WORD, element, i == lastWord, None, None, None, None)
+
+        parts = element["parts"]
+        lastPart = None
+        for part in reversed(parts):
+            # a sign, or a group that is not empty
+            if part.get("parts", part.get("tokens", True)):
+                lastPart = part
+                break
+
+        for part in parts:
+            if "parts" in part:
+                (group, subParts) = ("Determinative", part["parts"])
+            elif "tokens" in part:
+                (group, subParts) = ("Variant", part["tokens"])
+            else:
+                yield (SIGN, part, part is lastPart, None, None, None, None)
+                continue
+
+            end = len(subParts) - 1
+            isLastPart = part is lastPart
+            for (k, subPart) in enumerate(subParts):
+                atEnd = k == end
+                yield (SIGN, subPart, atEnd and isLastPart, group, k, atEnd, part)
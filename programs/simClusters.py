@@ -0,0 +1,164 @@
+from simLines import SIM_META
+
+# CLUSTERS OF PARALLEL LINES
+#
+# We cluster lines by the edges of the `sim` feature, in two ways:
+#
+# *   components: lines end up in the same cluster if there is a path of edges
+#     between them, optionally only via edges with a similarity of at least `minSim`;
+#     computed by union-find;
+# *   greedy: every line, in node order, joins the first cluster of which more than
+#     `clusterThreshold` of the members are similar to it, or else starts a new cluster;
+#     this is `makeClusters()` of the tutorial similarLines.ipynb.
+#
+# The greedy method only looks at the clusters that contain a line similar to the
+# line at hand, so both methods take time in proportion to the number of edges.
+#
+# Clusters are lists of sets of lines, ordered by their first line.
+# They can be saved as a node feature that gives every line the number of its cluster.
+
+CLUSTER_THRESHOLD = 0.5
+
+CLUSTER_META = {
+    "": SIM_META[""],
+    "cluster": {
+        "valueType": "int",
+        "description": "number of the cluster of similar lines that a line belongs to",
+    },
+}
+
+
+def neighbours(similarity, minSim=None):
+    """The similar lines of each line, from a similarity dict keyed by pairs."""
+    sisters = {}
+    for ((f, t), s) in similarity.items():
+        if minSim is None or s >= minSim:
+            sisters.setdefault(f, set()).add(t)
+            sisters.setdefault(t, set()).add(f)
+    return sisters
+
+
+def simNeighbours(api, lines=None, minSim=None, feature="sim"):
+    """The similar lines of each line, from a loaded edge feature."""
+    Es = api.Es
+    edges = Es(feature)
+    if lines is None:
+        lines = api.F.otype.s("line")
+
+    sisters = {}
+    for ln in lines:
+        lSisters = {m for (m, s) in edges.b(ln) if minSim is None or s >= minSim}
+        if lSisters:
+            sisters[ln] = lSisters
+    return sisters
+
+
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, x):
+        parent = self.parent
+        if x not in parent:
+            parent[x] = x
+            self.size[x] = 1
+            return x
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, x, y):
+        x = self.find(x)
+        y = self.find(y)
+        if x == y:
+            return
+        size = self.size
+        if size[x] < size[y]:
+            (x, y) = (y, x)
+        self.parent[y] = x
+        size[x] += size[y]
+
+
+def components(lines, sisters):
+    """The connected components of the lines under the similarity edges."""
+    uf = UnionFind()
+    for ln in lines:
+        uf.find(ln)
+    for (ln, lSisters) in sisters.items():
+        for m in lSisters:
+            uf.union(ln, m)
+
+    clusters = {}
+    for ln in sorted(lines):
+        clusters.setdefault(uf.find(ln), set()).add(ln)
+    return list(clusters.values())
+
+
+def greedyClusters(lines, sisters, clusterThreshold=CLUSTER_THRESHOLD, A=None):
+    """The clusters of `makeClusters()` in the tutorial similarLines.ipynb.
+
+    `clusterThreshold` should be 0 or more.
+    If the app `A` is given, progress is reported through it.
+    """
+    clusters = []
+    clusterOf = {}
+
+    if A is not None:
+        A.indent(reset=True)
+
+    chunkSize = 1000
+    j = 0
+
+    for ln in lines:
+        j += 1
+        if A is not None and j % chunkSize == 0:
+            A.info(f"{j:>5} lines and {len(clusters):>5} clusters")
+
+        counts = {}
+        for m in sisters.get(ln, ()):
+            c = clusterOf.get(m, None)
+            if c is not None:
+                counts[c] = counts.get(c, 0) + 1
+
+        target = None
+        for (c, n) in counts.items():
+            if n > clusterThreshold * len(clusters[c]):
+                if target is None or c < target:
+                    target = c
+
+        if target is None:
+            target = len(clusters)
+            clusters.append(set())
+        clusters[target].add(ln)
+        clusterOf[ln] = target
+
+    if A is not None:
+        A.info(f"{j} lines and {len(clusters)} clusters")
+    return clusters
+
+
+def clusterFeature(clusters):
+    """The cluster number of every line, clusters are numbered from 1."""
+    return {ln: i for (i, cl) in enumerate(clusters, start=1) for ln in cl}
+
+
+def saveClusters(
+    TF, clusters, location, module, feature="cluster", metaData=CLUSTER_META
+):
+    """Save clusters as a node feature."""
+    if feature != "cluster":
+        metaData = {
+            "": metaData[""],
+            feature: (
+                metaData[feature] if feature in metaData else metaData["cluster"]
+            ),
+        }
+
+    TF.save(
+        nodeFeatures={feature: clusterFeature(clusters)},
+        metaData=metaData,
+        location=location,
+        module=module,
+    )
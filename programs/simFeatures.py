@@ -0,0 +1,165 @@
+import numpy as np
+
+from simLines import READABLE_TYPES, SIM_META, THRESHOLD, getLines
+from simMatrix import MEMORY, computeBlocks, lineMatrix
+from simShards import dumpAtomic, loadData
+from simStore import SimStore
+
+# SIMILARITY MEASURES ON A SHARED FEATURE MATRIX
+#
+# The features of a line are its readings and graphemes (unigrams), as in
+# `simLines.makeSet()`, and optionally the pairs of consecutive readable signs in it
+# (bigrams), where a sign counts by its reading, or else its grapheme.
+#
+# The lines x features incidence matrix is built once per corpus version and can be
+# saved and loaded. All measures run on it with the block engine of `simMatrix`:
+#
+# *   jaccard: |x ∩ y| / |x ∪ y|; on unigrams this is `simLines.sim()`;
+# *   idf: as jaccard, but every feature counts with its inverse document frequency,
+#     so that common signs such as `ana`, `ina` and `DIŠ` weigh less than rare ones;
+# *   cosine: the cosine of the idf weighted vectors of x and y.
+#
+# With w the idf weights, M the matrix and W = M diag(w), the products needed are
+# M M^T (jaccard), W M^T (idf) and W W^T (cosine); the rest follows from row sums.
+#
+# Every measure is published as its own edge feature: jaccard as `sim`, idf as
+# `simidf`, cosine as `simcos`; with bigrams the names get `bi` appended.
+
+MEASURES = ("jaccard", "idf", "cosine")
+
+FEATURE_NAMES = dict(jaccard="sim", idf="simidf", cosine="simcos")
+
+DESCRIPTIONS = dict(
+    jaccard="common material wrt the combined material",
+    idf=(
+        "common material wrt the combined material, "
+        "where every item weighs by its inverse document frequency"
+    ),
+    cosine="cosine of the vectors of the lines, weighted by inverse document frequency",
+)
+
+
+def featureName(measure, bigrams=False):
+    return f"{FEATURE_NAMES[measure]}{'bi' if bigrams else ''}"
+
+
+def featureMeta(measure, bigrams=False):
+    """Metadata for the edge feature of a measure."""
+    material = (
+        "readings, graphemes and pairs of consecutive signs"
+        if bigrams
+        else "readings and graphemes"
+    )
+    return {
+        "": SIM_META[""],
+        featureName(measure, bigrams=bigrams): {
+            "valueType": "int",
+            "edgeValues": True,
+            "description": (
+                f"similarity between lines, as a percentage of the "
+                f"{DESCRIPTIONS[measure]}; lines are sets of {material}"
+            ),
+        },
+    }
+
+
+def getBigrams(api, ln):
+    F = api.F
+    L = api.L
+
+    bigrams = set()
+    prev = None
+    for s in L.d(ln, otype="sign"):
+        if F.type.v(s) not in READABLE_TYPES:
+            prev = None
+            continue
+        value = F.reading.v(s) or F.grapheme.v(s)
+        if prev is not None and value:
+            bigrams.add(f"{prev} {value}")
+        prev = value
+    return bigrams
+
+
+class FeatureMatrix:
+    def __init__(self, nodes, vocabulary, matrix, bigrams=False):
+        self.nodes = nodes
+        self.vocabulary = vocabulary
+        self.matrix = matrix
+        self.bigrams = bigrams
+
+        nLines = matrix.shape[0]
+        df = np.bincount(matrix.indices, minlength=matrix.shape[1])
+        self.idf = np.log((1 + nLines) / (1 + df)) + 1
+
+    @classmethod
+    def fromApi(cls, api, bigrams=False):
+        """The feature matrix of all lines with readings or graphemes."""
+        lines = getLines(api)
+        if bigrams:
+            for (ln, lineSet) in lines.items():
+                lineSet |= getBigrams(api, ln)
+        return cls(*lineMatrix(lines), bigrams=bigrams)
+
+    @classmethod
+    def load(cls, path):
+        data = loadData(path)
+        return cls(
+            data["nodes"], data["vocabulary"], data["matrix"], bigrams=data["bigrams"]
+        )
+
+    def save(self, path):
+        dumpAtomic(
+            dict(
+                nodes=self.nodes,
+                vocabulary=self.vocabulary,
+                matrix=self.matrix,
+                bigrams=self.bigrams,
+            ),
+            path,
+        )
+
+    def compute(self, measure, threshold=THRESHOLD, memory=MEMORY, A=None):
+        """The similarities of all pairs of lines under a measure.
+
+        Only pairs with a common feature are considered, so the threshold
+        should be more than 0.
+        """
+        matrix = self.matrix.astype(np.float64)
+        weighted = matrix.multiply(self.idf).tocsr()
+
+        if measure == "jaccard":
+            (left, right) = (self.matrix, self.matrix)
+            sizes = np.diff(self.matrix.indptr).astype(np.int64)
+
+            def score(rows, cols, inter):
+                return 100 * inter / (sizes[rows] + sizes[cols] - inter)
+
+        elif measure == "idf":
+            (left, right) = (weighted, matrix)
+            sizes = np.asarray(weighted.sum(axis=1)).ravel()
+
+            def score(rows, cols, inter):
+                return 100 * inter / (sizes[rows] + sizes[cols] - inter)
+
+        elif measure == "cosine":
+            (left, right) = (weighted, weighted)
+            norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+
+            def score(rows, cols, inner):
+                return 100 * inner / (norms[rows] * norms[cols])
+
+        else:
+            raise ValueError(f"Unknown measure {measure}, choose from {MEASURES}")
+
+        return computeBlocks(
+            self.nodes, left, right, score, threshold, memory=memory, A=A
+        )
+
+    def publish(self, similarity, measure, location, module):
+        """Write the similarities of a measure as its own edge feature."""
+        SimStore.fromSimilarity(similarity).writeTf(
+            location,
+            module,
+            feature=featureName(measure, bigrams=self.bigrams),
+            metaData=featureMeta(measure, bigrams=self.bigrams),
+        )
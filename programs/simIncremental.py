@@ -0,0 +1,133 @@
+import os
+
+from simLines import THRESHOLD, sim
+from simJoin import computeSimJoin, lowerBound
+from simShards import dumpAtomic, loadData
+
+# INCREMENTAL PARALLEL LINES
+#
+# When tablets are added or corrected, most lines stay the same, but their nodes
+# shift. So we identify lines by their section: (pnumber, face, lnno).
+# Should a section occur more than once, the later occurrences get their rank
+# appended: (pnumber, face, lnno, 1), etc.
+#
+# The state of a previous run has the line sets and the similarities,
+# both keyed by these identities.
+# In the next run:
+#
+# *   pairs of unchanged lines keep their score without recomputation;
+# *   pairs with a removed or changed line are dropped;
+# *   new and changed lines are compared with all current lines.
+#
+# For the last step we use an inverted index from sign values to lines:
+# lines without a common value have similarity 0, so we only compare lines with a
+# common value, unless the threshold is 0 or less, and whose sizes are not too far
+# apart.
+#
+# When there is no usable previous state, all lines are new, and we compute
+# everything by the similarity join of `simJoin`.
+#
+# The result is identical to that of `simLines.computeSim()` on the current lines.
+
+STATE = "sim-state.pickle.gz"
+
+
+def lineIdentities(api, lines):
+    """The identities of the lines, keyed by node."""
+    T = api.T
+    identities = {}
+    seen = {}
+
+    for ln in sorted(lines):
+        section = T.sectionFromNode(ln)
+        rank = seen.get(section, 0)
+        seen[section] = rank + 1
+        identities[ln] = section if rank == 0 else (*section, rank)
+
+    return identities
+
+
+def computeSimIncremental(
+    lines, identities, location, threshold=THRESHOLD, stateFile=STATE, A=None
+):
+    """Update the similarities of a previous run with the current lines.
+
+    `lines` are the current line sets and `identities` their identities,
+    both keyed by node, see `lineIdentities()`.
+    The state is read from and written to `stateFile` in `location`.
+    """
+    statePath = f"{location}/{stateFile}"
+    state = loadData(statePath) if os.path.exists(statePath) else None
+    if state is not None and state["threshold"] != threshold:
+        state = None
+    (oldSets, oldSim) = ({}, {}) if state is None else (state["lines"], state["sim"])
+
+    nodeOf = {identities[ln]: ln for ln in lines}
+    curSets = {identities[ln]: lineSet for (ln, lineSet) in lines.items()}
+    changed = {
+        key
+        for (key, lineSet) in curSets.items()
+        if key not in oldSets or oldSets[key] != lineSet
+    }
+    nChanged = len(changed)
+    nRemoved = sum(1 for key in oldSets if key not in curSets)
+
+    keyed = {
+        pair: s
+        for (pair, s) in oldSim.items()
+        if pair[0] in curSets
+        and pair[1] in curSets
+        and pair[0] not in changed
+        and pair[1] not in changed
+    }
+    nKept = len(keyed)
+
+    # a line can only be similar to lines of which the size is not too different
+
+    t = lowerBound(threshold)
+
+    if len(changed) == len(curSets):
+        keyed = computeSimJoin(curSets, threshold=threshold)
+        changed = set()
+    elif threshold > 0:
+        postings = {}
+        for (key, lineSet) in curSets.items():
+            for v in lineSet:
+                postings.setdefault(v, []).append(key)
+
+    for key in sorted(changed):
+        lineSet = curSets[key]
+        minSize = t * len(lineSet)
+        maxSize = len(lineSet) / t if t > 0 else None
+        if threshold <= 0:
+            candidatesOf = curSets
+        else:
+            candidatesOf = set()
+            for v in lineSet:
+                candidatesOf.update(postings[v])
+
+        for other in candidatesOf:
+            if other == key or (other in changed and other < key):
+                continue
+            otherSet = curSets[other]
+            if threshold > 0 and not minSize <= len(otherSet) <= maxSize:
+                continue
+            s = sim(lineSet, otherSet)
+            if s >= threshold:
+                keyed[(key, other) if key < other else (other, key)] = s
+
+    if A is not None:
+        A.info(
+            f"{nChanged} new or changed lines, {nRemoved} removed lines, "
+            f"{nKept} similarities kept, {len(keyed) - nKept} computed"
+        )
+
+    os.makedirs(location, exist_ok=True)
+    dumpAtomic(dict(threshold=threshold, lines=curSets, sim=keyed), statePath)
+
+    similarity = {}
+    for ((keyI, keyJ), s) in keyed.items():
+        nodeI = nodeOf[keyI]
+        nodeJ = nodeOf[keyJ]
+        similarity[(nodeI, nodeJ) if nodeI < nodeJ else (nodeJ, nodeI)] = s
+    return dict(sorted(similarity.items()))
@@ -0,0 +1,183 @@
+import os
+import re
+
+import numpy as np
+
+from simLines import getLines, lineSetFromValues
+from simShards import dumpAtomic, loadData
+
+# AN INDEX TO FIND SIMILAR LINES
+#
+# The index holds, for every line with a non-empty set (see `simLines.makeSet()`),
+# its node, its section, its text, and its set of sign values, and it has an
+# inverted index from every sign value to the rows of the lines in which it occurs.
+#
+# A query is a set of sign values, taken from a line in the corpus or from a raw
+# ATF string.
+# By adding up the postings of its values we get the intersection with every line,
+# the unions follow from the sizes, and the best k lines follow by a partial sort.
+# Scores are computed as by `simLines.sim()`.
+#
+# The index is saved in a single file, together with a stamp of the TF features it
+# has been built from, so that the query tool does not need to load TF.
+
+STAMP_FEATURES = ("otype", "oslots", "type", "reading", "grapheme")
+
+TOP = 10
+
+# ATF STRINGS
+#
+# A raw ATF line is reduced to the same set as the line would get in TF:
+# readings without their index, and graphemes as they are.
+# `a(MIN)` counts as the reading `a` plus the grapheme `MIN`.
+# Other parentheses, such as in `(x x)` and `{(: ...)}`, only delimit signs.
+# Numerals, unknown signs, ellipses, word dividers and language shifts do not count.
+
+LINE_NUMBER_RE = re.compile(r"""^[0-9]+'*\.\s+""")
+DROP_RE = re.compile(r"""[#?!*\[\]⸢⸣<>°\\]""")
+SEP_RE = re.compile(r"""[\s\-.+{}:/]+""")
+INDEX_RE = re.compile(r"""[₀-₉ₓ]+$""")
+LOGO_RE = re.compile(r"""([^\s\-.+{}:()]+)\(([^\s()]+)\)""")
+LOGO = "\x00"
+SKIP = {"x", "X", "..."}
+
+
+def isReading(value):
+    for c in value:
+        if c.isalpha():
+            return c.islower()
+    return False
+
+
+def atfSet(atf):
+    """The set of sign values of a line in ATF."""
+    atf = DROP_RE.sub("", LINE_NUMBER_RE.sub("", atf.strip()))
+    atf = LOGO_RE.sub(lambda match: f"{match.group(1)}{LOGO}{match.group(2)}", atf)
+    atf = atf.replace("(", " ").replace(")", " ")
+    values = []
+
+    for token in SEP_RE.split(atf):
+        if not token or token in SKIP or token[0].isdigit() or token[0] == "%":
+            continue
+        if LOGO in token:
+            (value, logo) = token.split(LOGO, 1)
+            if isReading(value):
+                values.append((INDEX_RE.sub("", value), logo))
+            else:
+                values.append((None, f"{value}({logo})"))
+        elif isReading(token):
+            values.append((INDEX_RE.sub("", token), None))
+        else:
+            values.append((None, token))
+
+    return lineSetFromValues(values)
+
+
+def featureStamp(tfDir):
+    """Sizes and modification times of the TF features the index depends on."""
+    stamp = []
+    for feat in STAMP_FEATURES:
+        path = f"{tfDir}/{feat}.tf"
+        if os.path.exists(path):
+            st = os.stat(path)
+            stamp.append((feat, st.st_size, int(st.st_mtime)))
+        else:
+            stamp.append((feat, None, None))
+    return tuple(stamp)
+
+
+class SimIndex:
+    def __init__(self, nodes, sections, texts, sets, stamp=None):
+        self.nodes = nodes
+        self.sections = sections
+        self.texts = texts
+        self.sets = sets
+        self.stamp = stamp
+        self.rowOf = {ln: i for (i, ln) in enumerate(nodes)}
+        self.sizes = np.array([len(s) for s in sets], dtype=np.int64)
+
+        postings = {}
+        for (i, lineSet) in enumerate(sets):
+            for v in lineSet:
+                postings.setdefault(v, []).append(i)
+        self.postings = {
+            v: np.array(rows, dtype=np.int32) for (v, rows) in postings.items()
+        }
+
+    @classmethod
+    def fromApi(cls, api, stamp=None):
+        """Build an index of all lines of a loaded TF dataset.
+
+        The features `type`, `reading` and `grapheme` must have been loaded.
+        """
+        T = api.T
+        lines = getLines(api)
+        nodes = sorted(lines)
+        return cls(
+            nodes,
+            [T.sectionFromNode(ln) for ln in nodes],
+            [T.text(ln).rstrip() for ln in nodes],
+            [lines[ln] for ln in nodes],
+            stamp=stamp,
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = loadData(path)
+        return cls(
+            data["nodes"], data["sections"], data["texts"], data["sets"], data["stamp"]
+        )
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        dumpAtomic(
+            dict(
+                nodes=self.nodes,
+                sections=self.sections,
+                texts=self.texts,
+                sets=self.sets,
+                stamp=self.stamp,
+            ),
+            path,
+        )
+
+    def lineSet(self, ln):
+        """The set of a line in the index, or None if it is not in the index."""
+        i = self.rowOf.get(ln, None)
+        return None if i is None else self.sets[i]
+
+    def query(self, lineSet, k=TOP, exclude=None):
+        """The k lines that are most similar to a set of sign values.
+
+        Returns tuples (node, score), best first, ties broken by node.
+        Lines without common values are never returned, and nothing is returned
+        if k is not positive.
+        `exclude` is a node that should not be returned, typically the line itself.
+        """
+        if not lineSet or k <= 0:
+            return []
+
+        found = [self.postings[v] for v in lineSet if v in self.postings]
+        if not found:
+            return []
+
+        rows = np.concatenate(found)
+        inter = np.bincount(rows, minlength=len(self.nodes))
+        hits = np.flatnonzero(inter)
+        if exclude is not None and exclude in self.rowOf:
+            hits = hits[hits != self.rowOf[exclude]]
+
+        inter = inter[hits]
+        union = self.sizes[hits] + len(lineSet) - inter
+        scores = np.rint(100 * inter / union).astype(np.int64)
+
+        if len(hits) > k:
+            # keep everything that ties with the k-th best score
+            kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+            keep = scores >= kth
+            hits = hits[keep]
+            scores = scores[keep]
+
+        order = np.lexsort((hits, -scores))[0:k]
+        nodes = self.nodes
+        return [(nodes[hits[i]], int(scores[i])) for i in order]
@@ -0,0 +1,127 @@
+from fractions import Fraction
+from math import ceil
+
+from simLines import THRESHOLD, sim, computeSim
+
+# EXACT PARALLEL LINES BY A SIMILARITY JOIN
+#
+# The same result as `simLines.computeSim()`, without comparing all pairs of lines.
+# This is the AllPairs/PPJoin method for Jaccard similarity joins.
+#
+# Sign values are ordered by rarity: the rarest value first.
+# Every line becomes the list of its values in that order, and the lines are
+# processed from short to long.
+# Two lines with Jaccard similarity at least t must share a value in the first
+# |x| - ceil(t|x|) + 1 values of each of them (the prefix).
+# So we only index the prefixes, and a line only meets earlier lines that have a
+# rare value of its own prefix in their prefix.
+# Moreover, a line y can only be similar to a longer line x if |y| >= t|x|
+# (length filter), and the positions where the shared value occurs give an upper
+# bound on the overlap that can still be reached (positional filter).
+# The candidates that survive are scored with `sim()` itself.
+#
+# Scores are rounded, so a score of THRESHOLD is reached from a Jaccard similarity of
+# (THRESHOLD - 0.5) / 100 on. We filter with a slightly lower bound, which costs a
+# few more candidates, but never loses a pair.
+
+MARGIN = Fraction(1, 10**6)
+
+
+def lowerBound(threshold):
+    """The smallest Jaccard similarity that can still be scored at the threshold."""
+    return Fraction(2 * threshold - 1, 200) - MARGIN
+
+
+def orderValues(lines):
+    """Ranks of the sign values, the rarest value gets rank 0."""
+    freqs = {}
+    for lineSet in lines.values():
+        for v in lineSet:
+            freqs[v] = freqs.get(v, 0) + 1
+    return {v: i for (i, v) in enumerate(sorted(freqs, key=lambda v: (freqs[v], v)))}
+
+
+def computeSimJoin(lines, threshold=THRESHOLD, A=None):
+    """Compare only the pairs of lines that pass the prefix filters.
+
+    The result is identical to that of `simLines.computeSim()`.
+    If the app `A` is given, the numbers of candidates and results are reported
+    through it.
+    """
+    t = lowerBound(threshold)
+    if t <= 0:
+        # every pair qualifies, even pairs without common values
+        return computeSim(lines, threshold=threshold, A=A)
+
+    ranks = orderValues(lines)
+    records = sorted(
+        ((sorted(ranks[v] for v in lineSet), ln) for (ln, lineSet) in lines.items()),
+        key=lambda r: (len(r[0]), r[1]),
+    )
+
+    # the overlap needed by lines with sizes that add up to n
+
+    tt = t / (1 + t)
+    neededFor = {}
+
+    index = {}
+    start = {}
+    similarity = {}
+    nCandidates = 0
+
+    for (x, nodeX) in records:
+        sizeX = len(x)
+        minSize = ceil(t * sizeX)
+        prefixX = sizeX - minSize + 1
+        overlaps = {}
+
+        for i in range(prefixX):
+            w = x[i]
+            postings = index.get(w, None)
+            if postings is None:
+                continue
+
+            # the postings are sorted by size, drop the ones that are too short
+
+            s = start[w]
+            nPostings = len(postings)
+            while s < nPostings and postings[s][1] < minSize:
+                s += 1
+            start[w] = s
+
+            for p in range(s, nPostings):
+                (nodeY, sizeY, j) = postings[p]
+                current = overlaps.get(nodeY, 0)
+                if current < 0:
+                    continue
+                needed = neededFor.get(sizeX + sizeY, None)
+                if needed is None:
+                    needed = ceil(tt * (sizeX + sizeY))
+                    neededFor[sizeX + sizeY] = needed
+                bound = 1 + min(sizeX - i - 1, sizeY - j - 1)
+                overlaps[nodeY] = current + 1 if current + bound >= needed else -1
+
+        for (i, w) in enumerate(x[0:prefixX]):
+            if w in index:
+                index[w].append((nodeX, sizeX, i))
+            else:
+                index[w] = [(nodeX, sizeX, i)]
+                start[w] = 0
+
+        lineX = lines[nodeX]
+        for (nodeY, overlap) in overlaps.items():
+            if overlap <= 0:
+                continue
+            nCandidates += 1
+            s = sim(lineX, lines[nodeY])
+            if s >= threshold:
+                pair = (nodeX, nodeY) if nodeX < nodeY else (nodeY, nodeX)
+                similarity[pair] = s
+
+    if A is not None:
+        nLines = len(lines)
+        A.info(
+            f"{nCandidates} candidates out of {nLines * (nLines - 1) // 2} pairs "
+            f"and {len(similarity)} similarities"
+        )
+    return dict(sorted(similarity.items()))
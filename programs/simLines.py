@@ -0,0 +1,162 @@
+import os
+
+# PARALLEL LINES
+#
+# Shared definitions for the computation of parallel lines, see parallels.ipynb.
+#
+# We reduce a line to the set of readings and graphemes in it,
+# excluding unknown signs and ellipses.
+# The similarity between two lines is the length of the intersection divided by
+# the length of the union of their sets, times 100, rounded to an integer.
+# Lines are parallel if their similarity is at least THRESHOLD.
+#
+# A similarity result is a dict keyed by pairs `(nodeI, nodeJ)` with `nodeI < nodeJ`,
+# and valued by the similarity of those two lines.
+#
+# The functions here take the TF api as argument, e.g. `A.api`.
+
+READABLE_TYPES = {"reading", "grapheme"}
+
+THRESHOLD = 80
+
+SIM_META = {
+    "": {
+        "name": "Nineveh Medical Encyclopedia Cuneiform",
+        "editor": "Cale Johnson et. al.",
+        "institute": "Institut für Wissensgeschichte des Altertums",
+        "converters": "Cale Johnson, Dirk Roorda",
+    },
+    "sim": {
+        "valueType": "int",
+        "edgeValues": True,
+        "description": (
+            "similarity between lines, as a percentage of the common material "
+            "wrt the combined material"
+        ),
+    },
+}
+
+
+def lineSetFromValues(values):
+    """The set of a line, given the reading and grapheme of its readable signs."""
+    lineSet = set()
+    for (r, g) in values:
+        if r:
+            lineSet.add(r)
+        if g:
+            lineSet.add(g)
+    return lineSet
+
+
+def makeSet(api, ln):
+    F = api.F
+    L = api.L
+
+    return lineSetFromValues(
+        (F.reading.v(s), F.grapheme.v(s))
+        for s in L.d(ln, otype="sign")
+        if F.type.v(s) in READABLE_TYPES
+    )
+
+
+def getLines(api):
+    """The sets of all lines that have a non-empty set, keyed by line node."""
+    lines = {}
+
+    for ln in api.F.otype.s("line"):
+        lineSet = makeSet(api, ln)
+        if lineSet:
+            lines[ln] = lineSet
+
+    return lines
+
+
+def sim(lSet, mSet):
+    return int(round(100 * len(lSet & mSet) / len(lSet | mSet)))
+
+
+def computeSim(lines, threshold=THRESHOLD, limit=None, A=None):
+    """Compare all pairs of lines, the straightforward way.
+
+    If `limit` is given, stop after that percentage of the comparisons.
+    If the app `A` is given, progress is reported through it.
+    """
+    similarity = {}
+
+    lineNodes = sorted(lines.keys())
+    nLines = len(lineNodes)
+
+    nComparisons = nLines * (nLines - 1) // 2
+
+    if A is not None:
+        A.info(f"{nComparisons} comparisons to make")
+    chunkSize = max(nComparisons // 100, 1)
+
+    co = 0
+    b = 0
+    si = 0
+    p = 0
+
+    if A is not None:
+        A.indent(reset=True)
+
+    stop = False
+    for i in range(nLines):
+        nodeI = lineNodes[i]
+        lineI = lines[nodeI]
+        for j in range(i + 1, nLines):
+            nodeJ = lineNodes[j]
+            lineJ = lines[nodeJ]
+            s = sim(lineI, lineJ)
+            co += 1
+            b += 1
+            if b == chunkSize:
+                p += 1
+                if A is not None:
+                    A.info(
+                        f"{p:>3}% - {co:>12} comparisons and {si:>10} similarities"
+                    )
+                b = 0
+                if limit is not None and p >= limit:
+                    stop = True
+                    break
+
+            if s < threshold:
+                continue
+            similarity[(nodeI, nodeJ)] = s
+            si += 1
+        if stop:
+            break
+
+    if A is not None:
+        A.info(f"{p:>3}% - {co:>12} comparisons and {si:>10} similarities")
+    return similarity
+
+
+def simLocation(A, subdir="parallels"):
+    """The location of the parallels module of the corpus of app `A`."""
+    ghBase = os.path.expanduser("~/github")
+    return f"{ghBase}/{A.context.org}/{A.context.repo}/{subdir}/tf"
+
+
+def saveSim(TF, similarity, location, module, feature="sim", metaData=SIM_META):
+    """Save a similarity result as an edge feature.
+
+    Every pair is saved once, from the smaller node to the bigger node.
+    """
+    simData = {}
+    for ((f, t), d) in similarity.items():
+        simData.setdefault(f, {})[t] = d
+
+    if feature != "sim":
+        metaData = {
+            "": metaData[""],
+            feature: metaData[feature] if feature in metaData else metaData["sim"],
+        }
+
+    TF.save(
+        edgeFeatures={feature: simData},
+        metaData=metaData,
+        location=location,
+        module=module,
+    )
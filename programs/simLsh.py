@@ -0,0 +1,103 @@
+import collections
+
+import numpy as np
+
+from simLines import THRESHOLD, sim
+
+# PARALLEL LINES BY LOCALITY SENSITIVE HASHING
+#
+# Instead of comparing all pairs of lines, we compute a MinHash signature for
+# every line set, cut the signatures in bands, and only compare lines that agree
+# on at least one band.
+# Two lines with Jaccard similarity J end up as candidates with probability
+# 1 - (1 - J^ROWS)^BANDS; with 20 bands of 5 rows that is 0.9996 for J = 0.8
+# and 0.47 for J = 0.5.
+# Candidates are scored exactly, so there are no false positives,
+# but a parallel may occasionally be missed: compare with the exact result
+# through `recall()`.
+
+BANDS = 20
+ROWS = 5
+SEED = 19
+PRIME = (1 << 31) - 1
+CHUNK = 1024
+
+
+def encode(lines):
+    """Encode line sets as arrays of integer ids of their sign values."""
+    vocabulary = sorted(set().union(*lines.values()))
+    ids = {value: i for (i, value) in enumerate(vocabulary)}
+    return {
+        ln: np.fromiter((ids[v] for v in lineSet), dtype=np.int64, count=len(lineSet))
+        for (ln, lineSet) in lines.items()
+    }
+
+
+def signatures(encoded, nodes, nHashes, seed=SEED):
+    """MinHash signatures of the encoded lines, one row per node."""
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, PRIME, size=(nHashes, 1)).astype(np.int64)
+    b = rng.randint(0, PRIME, size=(nHashes, 1)).astype(np.int64)
+
+    result = np.empty((len(nodes), nHashes), dtype=np.int64)
+
+    for start in range(0, len(nodes), CHUNK):
+        chunk = nodes[start : start + CHUNK]
+        sizes = [len(encoded[ln]) for ln in chunk]
+        values = np.concatenate([encoded[ln] for ln in chunk])
+        offsets = np.cumsum([0] + sizes[0:-1])
+        hashed = (a * values + b) % PRIME
+        result[start : start + len(chunk)] = np.minimum.reduceat(
+            hashed, offsets, axis=1
+        ).T
+
+    return result
+
+
+def candidates(sigs, bands=BANDS, rows=ROWS):
+    """Pairs of row indices that share at least one band of their signatures."""
+    pairs = set()
+
+    for band in range(bands):
+        buckets = collections.defaultdict(list)
+        part = np.ascontiguousarray(sigs[:, band * rows : (band + 1) * rows])
+        for (i, row) in enumerate(part):
+            buckets[row.tobytes()].append(i)
+        for members in buckets.values():
+            n = len(members)
+            if n > 1:
+                for x in range(n):
+                    mx = members[x]
+                    for y in range(x + 1, n):
+                        pairs.add((mx, members[y]))
+
+    return pairs
+
+
+def computeSimLsh(lines, threshold=THRESHOLD, bands=BANDS, rows=ROWS, seed=SEED):
+    """Similar pairs of lines, found by verifying the LSH candidates.
+
+    The result has the same shape as that of `simLines.computeSim()`.
+    """
+    nodes = sorted(lines)
+    sigs = signatures(encode(lines), nodes, bands * rows, seed=seed)
+    similarity = {}
+
+    for (i, j) in candidates(sigs, bands=bands, rows=rows):
+        nodeI = nodes[i]
+        nodeJ = nodes[j]
+        s = sim(lines[nodeI], lines[nodeJ])
+        if s >= threshold:
+            similarity[(nodeI, nodeJ)] = s
+
+    return dict(sorted(similarity.items()))
+
+
+def recall(similarity, exact):
+    """Which fraction of the exactly computed pairs has been found.
+
+    Returns the fraction, the number of pairs found, and the number of exact pairs.
+    """
+    found = sum(1 for pair in exact if pair in similarity)
+    nExact = len(exact)
+    return (found / nExact if nExact else 1.0, found, nExact)
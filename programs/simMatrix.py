@@ -0,0 +1,135 @@
+import numpy as np
+from scipy import sparse
+
+from simLines import THRESHOLD, computeSim
+
+# PARALLEL LINES BY SPARSE MATRIX PRODUCTS
+#
+# The line sets are encoded once as a sparse incidence matrix M in CSR format:
+# a row per line, a column per sign value, and a 1 where the value occurs in the line.
+# Then the intersections of all pairs of lines are the entries of M . M^T, and the
+# union of lines i and j is |i| + |j| - intersection.
+#
+# The product is computed in blocks of rows, and only the part at the right of the
+# diagonal, so every pair is computed once.
+# The number of rows in a block is such that the block stays within a memory budget.
+# The scores and the threshold filter are computed on whole blocks at once.
+# Only pairs with a common value are in the product, so for a threshold of 0 or less
+# we fall back to `simLines.computeSim()`.
+
+MEMORY = 256 * 1024 * 1024
+
+# per cell of a block: an int32 intersection, an int32 column index, and the
+# float64 scores and masks of the filter
+
+BYTES_PER_CELL = 24
+
+
+def lineMatrix(lines):
+    """Encode line sets as an incidence matrix.
+
+    Returns the line nodes in the order of the rows, the sign values in the
+    order of the columns, and the matrix.
+    """
+    nodes = sorted(lines)
+    vocabulary = sorted(set().union(*lines.values()))
+    ids = {value: i for (i, value) in enumerate(vocabulary)}
+
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    indices = []
+    for (r, ln) in enumerate(nodes):
+        lineIds = sorted(ids[v] for v in lines[ln])
+        indices.extend(lineIds)
+        indptr[r + 1] = indptr[r] + len(lineIds)
+
+    indices = np.array(indices, dtype=np.int32)
+    data = np.ones(len(indices), dtype=np.int32)
+    matrix = sparse.csr_matrix(
+        (data, indices, indptr), shape=(len(nodes), len(vocabulary))
+    )
+    return (nodes, vocabulary, matrix)
+
+
+def blockSize(nLines, memory=MEMORY):
+    """How many rows of the product fit in the memory budget."""
+    return max(1, min(nLines, memory // max(1, nLines * BYTES_PER_CELL)))
+
+
+def simBlock(left, right, lo, hi, score, threshold):
+    """Similar pairs between rows lo up to hi and all later rows.
+
+    The products of the rows of `left` with the rows of `right` are turned into
+    percentages by `score(rows, cols, products)`, which are rounded to integers.
+    Returns row indices, column indices and scores.
+    """
+    product = (left[lo:hi] @ right[lo:].T).tocoo()
+    rows = product.row.astype(np.int64) + lo
+    cols = product.col.astype(np.int64) + lo
+    values = product.data
+
+    keep = cols > rows
+    rows = rows[keep]
+    cols = cols[keep]
+    values = values[keep]
+
+    scores = np.rint(score(rows, cols, values)).astype(np.int64)
+
+    keep = scores >= threshold
+    rows = rows[keep]
+    cols = cols[keep]
+    scores = scores[keep]
+
+    order = np.lexsort((cols, rows))
+    return (rows[order], cols[order], scores[order])
+
+
+def computeBlocks(nodes, left, right, score, threshold, memory=MEMORY, A=None):
+    """Compute the similarities of all pairs of rows, block by block.
+
+    Returns a dict keyed by pairs of nodes, as `simLines.computeSim()` does.
+    """
+    nLines = len(nodes)
+    nodeArray = np.array(nodes, dtype=np.int64)
+    step = blockSize(nLines, memory=memory)
+
+    if A is not None:
+        A.info(
+            f"{nLines} lines x {left.shape[1]} values in blocks of {step} lines"
+        )
+
+    similarity = {}
+
+    for lo in range(0, nLines, step):
+        hi = min(lo + step, nLines)
+        (rows, cols, scores) = simBlock(left, right, lo, hi, score, threshold)
+        similarity.update(
+            zip(
+                zip(nodeArray[rows].tolist(), nodeArray[cols].tolist()),
+                scores.tolist(),
+            )
+        )
+        if A is not None:
+            A.info(f"{hi:>6} lines done and {len(similarity):>10} similarities")
+
+    return similarity
+
+
+def computeSimMatrix(lines, threshold=THRESHOLD, memory=MEMORY, A=None):
+    """Compute all similarities with blocked sparse matrix products.
+
+    The result is identical to that of `simLines.computeSim()`.
+    `memory` is the budget in bytes for a single block.
+    If the app `A` is given, progress is reported through it.
+    """
+    if threshold <= 0:
+        return computeSim(lines, threshold=threshold, A=A)
+
+    (nodes, vocabulary, matrix) = lineMatrix(lines)
+    sizes = np.asarray(matrix.sum(axis=1)).ravel().astype(np.int64)
+
+    def jaccard(rows, cols, inter):
+        return 100 * inter / (sizes[rows] + sizes[cols] - inter)
+
+    return computeBlocks(
+        nodes, matrix, matrix, jaccard, threshold, memory=memory, A=A
+    )
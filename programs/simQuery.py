@@ -0,0 +1,117 @@
+import sys
+import time
+
+from tf.fabric import Fabric
+
+from tfFromJson import REPO_DIR, TEMP_DIR, VERSION_TF
+from simIndex import TOP, SimIndex, atfSet, featureStamp
+
+HELP = """
+python3 simQuery.py node
+    Show the lines that are most similar to the line with this node
+python3 simQuery.py "ATF"
+    Show the lines that are most similar to a line given in ATF,
+    e.g. "DIŠ NA SAG.KI-šu₂ GU₇-šu₂"
+python3 simQuery.py -index
+    Rebuild the index of lines
+
+Options, to be combined with the commands above:
+
+-k=n
+    Show the n most similar lines instead of 10; n is at least 1
+
+The index is built from the TF data when it is missing or when the TF data has
+changed since; that needs a few seconds; after that, queries take milliseconds.
+"""
+
+TF_DIR = f"{REPO_DIR}/tf/{VERSION_TF}"
+INDEX_FILE = f"{TEMP_DIR}/parallels/index-{VERSION_TF}.pickle.gz"
+FEATURES = "type reading grapheme atfpre atf atfpost after"
+
+
+def msg(m):
+    sys.stdout.write(f"{m}\n")
+
+
+def buildIndex(stamp):
+    msg(f"Building the index of lines from {TF_DIR}")
+    TF = Fabric(locations=[TF_DIR], silent="deep")
+    api = TF.load(FEATURES, silent="deep")
+    if not api:
+        return None
+    index = SimIndex.fromApi(api, stamp=stamp)
+    index.save(INDEX_FILE)
+    msg(f"{len(index.nodes)} lines indexed in {INDEX_FILE}")
+    return index
+
+
+def getIndex(rebuild=False):
+    stamp = featureStamp(TF_DIR)
+    if not rebuild:
+        try:
+            index = SimIndex.load(INDEX_FILE)
+        except FileNotFoundError:
+            index = None
+        if index is not None and index.stamp == stamp:
+            return index
+    return buildIndex(stamp)
+
+
+def showLine(index, ln, score=None):
+    i = index.rowOf[ln]
+    (pnumber, face, lnno) = index.sections[i][0:3]
+    scoreRep = "   " if score is None else f"{score:>3}"
+    msg(f"{scoreRep} {ln:>6} {pnumber} {face}:{lnno} {index.texts[i]}")
+
+
+def main(query, k):
+    index = getIndex()
+    if index is None:
+        return
+
+    start = time.perf_counter()
+
+    if query.isdigit():
+        ln = int(query)
+        lineSet = index.lineSet(ln)
+        if lineSet is None:
+            msg(f"{ln} is not a line with readings or graphemes")
+            return
+        showLine(index, ln)
+        results = index.query(lineSet, k=k, exclude=ln)
+    else:
+        lineSet = atfSet(query)
+        msg(f"        {' '.join(sorted(lineSet))}")
+        results = index.query(lineSet, k=k)
+
+    elapsed = (time.perf_counter() - start) * 1000
+    msg(f"{len(results)} similar lines in {elapsed:.1f} ms")
+    for (m, score) in results:
+        showLine(index, m, score=score)
+
+
+args = sys.argv[1:]
+options = [arg for arg in args if arg.startswith("-k=")]
+commands = [arg for arg in args if arg not in options]
+command = None if len(commands) == 0 else commands[0]
+
+k = TOP
+good = True
+for option in options:
+    value = option[3:]
+    if value.isdigit() and int(value) > 0:
+        k = int(value)
+    else:
+        msg(f"Wrong option {option} !")
+        good = False
+
+if not good:
+    pass
+elif len(commands) != 1:
+    msg(HELP)
+elif command == "-index":
+    getIndex(rebuild=True)
+elif command.startswith("-"):
+    msg(f"Wrong command {command} !\n{HELP}")
+else:
+    main(command, k)
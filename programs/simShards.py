@@ -0,0 +1,187 @@
+import os
+import json
+import gzip
+import pickle
+import hashlib
+
+from jsonSource import mapFiles, poolSize
+from simLines import THRESHOLD, sim
+
+# PARALLEL LINES IN SHARDS, WITH CHECKPOINTS
+#
+# The comparisons of all pairs of lines form the upper triangle of a square.
+# We cut that triangle in shards of consecutive rows, such that every shard has
+# about the same number of comparisons, and compute the shards in a process pool.
+#
+# Every finished shard is written to its own file in the checkpoint directory,
+# next to the line sets it has been computed from.
+# When a run is interrupted, the next run with the same lines and threshold only
+# computes the shards that are missing.
+# When the lines or the threshold have changed, the old shards are discarded.
+#
+# The checkpoint directory of `sim-<version>` is `A.tempDir/parallels/sim-<version>`:
+#
+#   info.json               fingerprint of the lines, threshold and shard bounds
+#   lines.pickle.gz         the line sets, read by the workers
+#   shard-0000.pickle.gz    the similarities found by shard 0
+#   ...
+
+SHARDS = 100
+INFO = "info.json"
+LINES = "lines.pickle.gz"
+
+
+def shardFile(k):
+    return f"shard-{k:04}.pickle.gz"
+
+
+def dumpAtomic(data, path):
+    tmpPath = f"{path}.tmp"
+    with gzip.open(tmpPath, "wb") as fh:
+        pickle.dump(data, fh)
+    os.replace(tmpPath, path)
+
+
+def loadData(path):
+    with gzip.open(path, "rb") as fh:
+        return pickle.load(fh)
+
+
+def fingerprint(lines, threshold):
+    h = hashlib.sha1(f"{threshold}".encode("utf8"))
+    for ln in sorted(lines):
+        h.update(f"{ln}\t{' '.join(sorted(lines[ln]))}\n".encode("utf8"))
+    return h.hexdigest()
+
+
+def shardBounds(nLines, nShards):
+    """Cut the rows in at most nShards ranges with equal numbers of comparisons.
+
+    Row i is compared with the nLines - 1 - i rows after it.
+    """
+    total = nLines * (nLines - 1) // 2
+    nShards = max(1, min(nShards, nLines - 1))
+    bounds = [0]
+    done = 0
+    target = 1
+
+    for i in range(nLines):
+        done += nLines - 1 - i
+        if done >= target * total / nShards and done < total:
+            bounds.append(i + 1)
+            while done >= target * total / nShards:
+                target += 1
+    bounds.append(nLines)
+    return bounds
+
+
+# WORKERS
+#
+# A worker reads the line sets once from the checkpoint directory,
+# and computes shards of the triangle, each time writing the result to a file.
+# The line sets are kept under their fingerprint, because they are rewritten when
+# the lines change, and a worker may live longer than one set of lines.
+
+workerLines = {}
+
+
+def getLines(location, fp):
+    key = (location, fp)
+    if key not in workerLines:
+        workerLines.clear()
+        lines = loadData(f"{location}/{LINES}")
+        workerLines[key] = (sorted(lines), lines)
+    return workerLines[key]
+
+
+def computeShard(task):
+    (location, fp, k, lo, hi, threshold) = task
+    (lineNodes, lines) = getLines(location, fp)
+    nLines = len(lineNodes)
+    similarity = {}
+
+    for i in range(lo, hi):
+        nodeI = lineNodes[i]
+        lineI = lines[nodeI]
+        for j in range(i + 1, nLines):
+            nodeJ = lineNodes[j]
+            s = sim(lineI, lines[nodeJ])
+            if s >= threshold:
+                similarity[(nodeI, nodeJ)] = s
+
+    dumpAtomic(similarity, f"{location}/{shardFile(k)}")
+    return len(similarity)
+
+
+# RUNNER
+
+
+def prepare(lines, location, threshold, nShards):
+    """Set up the checkpoint directory and return the fingerprint and shard bounds.
+
+    Existing shards are kept if they have been computed for the same lines
+    and threshold.
+    """
+    os.makedirs(location, exist_ok=True)
+    infoPath = f"{location}/{INFO}"
+    fp = fingerprint(lines, threshold)
+
+    if os.path.exists(infoPath):
+        with open(infoPath) as fh:
+            info = json.load(fh)
+        if info["fingerprint"] == fp and os.path.exists(f"{location}/{LINES}"):
+            return (fp, info["bounds"])
+
+    for fileName in os.listdir(location):
+        if fileName.startswith("shard-"):
+            os.unlink(f"{location}/{fileName}")
+
+    bounds = shardBounds(len(lines), nShards)
+    dumpAtomic(lines, f"{location}/{LINES}")
+    tmpPath = f"{infoPath}.tmp"
+    with open(tmpPath, "w") as fh:
+        json.dump(dict(fingerprint=fp, threshold=threshold, bounds=bounds), fh)
+    os.replace(tmpPath, infoPath)
+    workerLines.clear()
+    return (fp, bounds)
+
+
+def computeSimShards(
+    lines, location, name, threshold=THRESHOLD, shards=SHARDS, workers=None, A=None
+):
+    """Compute all similarities shard by shard, resuming earlier work.
+
+    The checkpoints go to the directory `name` in `location`.
+    The result is identical to that of `simLines.computeSim()`.
+    If the app `A` is given, progress is reported through it.
+    """
+    location = f"{location}/{name}"
+    (fp, bounds) = prepare(lines, location, threshold, shards)
+    nShards = len(bounds) - 1
+    tasks = [
+        (location, fp, k, bounds[k], bounds[k + 1], threshold)
+        for k in range(nShards)
+        if not os.path.exists(f"{location}/{shardFile(k)}")
+    ]
+    nDone = nShards - len(tasks)
+
+    if A is not None:
+        A.info(
+            f"{nShards} shards of which {nDone} done before, "
+            f"{poolSize(len(tasks), workers=workers)} workers"
+        )
+        A.indent(reset=True)
+
+    for (task, nFound) in mapFiles(computeShard, tasks, workers=workers):
+        nDone += 1
+        if A is not None:
+            A.info(f"{nDone:>4} of {nShards} shards done, shard {task[2]}: {nFound:>6}")
+
+    return readShards(location, nShards)
+
+
+def readShards(location, nShards):
+    similarity = {}
+    for k in range(nShards):
+        similarity.update(loadData(f"{location}/{shardFile(k)}"))
+    return similarity
@@ -0,0 +1,174 @@
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+from simLines import SIM_META
+
+# COLUMNAR STORAGE OF SIMILARITIES
+#
+# A similarity result as a dict keyed by pairs of nodes costs a tuple and a few ints
+# per pair, in memory and when pickled.
+# Here we store it as three arrays: source nodes, target nodes, and scores.
+# Every pair is stored in both directions, so that the neighbours of a line are
+# a single contiguous slice.
+# The arrays are sorted by source, then by descending score, then by target,
+# so the neighbours at or above a score are a prefix of that slice.
+#
+# An offset array, indexed by node, gives the start of the slice of every node:
+# the neighbours of n are at offsets[n] up to offsets[n + 1].
+#
+# The arrays are saved as .npy files in a directory and can be loaded memory mapped,
+# so that a query only touches the pages of the slices it needs.
+
+ARRAYS = ("src", "tgt", "score", "offsets")
+
+
+class SimStore:
+    def __init__(self, src, tgt, score, offsets):
+        self.src = src
+        self.tgt = tgt
+        self.score = score
+        self.offsets = offsets
+
+    @classmethod
+    def fromSimilarity(cls, similarity):
+        """Make a store out of a dict keyed by pairs of nodes."""
+        n = len(similarity)
+        pairs = np.fromiter(
+            (x for pair in similarity for x in pair), dtype=np.int32, count=2 * n
+        ).reshape((n, 2))
+        scores = np.fromiter(similarity.values(), dtype=np.uint8, count=n)
+        return cls.fromArrays(pairs[:, 0], pairs[:, 1], scores)
+
+    @classmethod
+    def fromArrays(cls, src, tgt, score):
+        """Make a store out of pairs given in one direction."""
+        (src, tgt) = (
+            np.concatenate((src, tgt)).astype(np.int32),
+            np.concatenate((tgt, src)).astype(np.int32),
+        )
+        score = np.concatenate((score, score)).astype(np.uint8)
+
+        order = np.lexsort((tgt, -score.astype(np.int16), src))
+        src = src[order]
+        tgt = tgt[order]
+        score = score[order]
+
+        maxNode = int(src[-1]) if len(src) else 0
+        offsets = np.zeros(maxNode + 2, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=maxNode + 1), out=offsets[1:])
+        return cls(src, tgt, score, offsets)
+
+    @classmethod
+    def load(cls, location, mmap=True):
+        """Load a store from its directory, memory mapped unless `mmap` is False."""
+        mode = "r" if mmap else None
+        return cls(
+            *(np.load(f"{location}/{name}.npy", mmap_mode=mode) for name in ARRAYS)
+        )
+
+    def save(self, location):
+        os.makedirs(location, exist_ok=True)
+        for name in ARRAYS:
+            path = f"{location}/{name}.npy"
+            tmpPath = f"{location}/{name}.tmp.npy"
+            np.save(tmpPath, getattr(self, name))
+            os.replace(tmpPath, path)
+
+    def __len__(self):
+        """The number of similar pairs."""
+        return len(self.src) // 2
+
+    def neighbours(self, n, minScore=None):
+        """The lines similar to line n, at or above `minScore`.
+
+        Returns an array of nodes and an array of their scores, highest score first.
+        """
+        offsets = self.offsets
+        if n < 0 or n + 1 >= len(offsets):
+            return (self.tgt[0:0], self.score[0:0])
+
+        lo = int(offsets[n])
+        hi = int(offsets[n + 1])
+        if minScore is not None:
+            ascending = self.score[lo:hi][::-1]
+            hi -= int(np.searchsorted(ascending, minScore, side="left"))
+        return (self.tgt[lo:hi], self.score[lo:hi])
+
+    def toSimilarity(self):
+        """The store as a dict keyed by pairs of nodes, as by `computeSim()`."""
+        keep = self.src < self.tgt
+        src = self.src[keep]
+        tgt = self.tgt[keep]
+        score = self.score[keep]
+        order = np.lexsort((tgt, src))
+        return dict(
+            zip(
+                zip(src[order].tolist(), tgt[order].tolist()),
+                score[order].tolist(),
+            )
+        )
+
+    def writeTf(self, location, module, feature="sim", metaData=SIM_META):
+        """Write the store as an edge feature, in the way `TF.save()` does.
+
+        Every pair is written once, from the smaller node to the bigger node.
+        """
+        meta = dict(metaData[""])
+        meta.update(metaData[feature] if feature in metaData else metaData["sim"])
+        edgeValues = meta.pop("edgeValues", False)
+
+        keep = self.src < self.tgt
+        src = self.src[keep]
+        tgt = self.tgt[keep]
+        score = self.score[keep]
+        order = np.lexsort((tgt, score, src))
+        src = src[order].tolist()
+        tgt = tgt[order].tolist()
+        score = score[order].tolist()
+
+        dirName = f"{location}/{module}"
+        os.makedirs(dirName, exist_ok=True)
+        now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+        with open(f"{dirName}/{feature}.tf", "w", encoding="utf8") as fh:
+            fh.write("@edge\n")
+            if edgeValues:
+                fh.write("@edgeValues\n")
+            for k in sorted(meta):
+                fh.write(f"@{k}={meta[k]}\n")
+            fh.write("@writtenBy=Text-Fabric\n")
+            fh.write(f"@dateWritten={now.isoformat()}Z\n")
+            fh.write("\n")
+
+            implicitNode = 1
+            nPairs = len(src)
+            i = 0
+            while i < nPairs:
+                (n, s) = (src[i], score[i])
+                j = i
+                while j < nPairs and src[j] == n and score[j] == s:
+                    j += 1
+                nodeSpec = "" if n == implicitNode else f"{n}\t"
+                implicitNode = n + 1
+                targets = rangeSpec(tgt[i:j])
+                value = f"\t{s}" if edgeValues else ""
+                fh.write(f"{nodeSpec}{targets}{value}\n")
+                i = j
+
+
+def rangeSpec(nodes):
+    """Sorted nodes as a TF node specification, e.g. `3,5-8,10`."""
+    parts = []
+    start = nodes[0]
+    end = start
+    for n in nodes[1:]:
+        if n == end + 1:
+            end = n
+            continue
+        parts.append(f"{start}" if start == end else f"{start}-{end}")
+        start = n
+        end = n
+    parts.append(f"{start}" if start == end else f"{start}-{end}")
+    return ",".join(parts)
@@ -0,0 +1,180 @@
+import sys
+import os
+import json
+import random
+import collections
+
+from jsonSource import getJsonFiles, readJsonFile
+from tfFromJson import IN_DIR, SYNTH_DIR, clusterType, synthDirs
+
+HELP = """
+python3 synthCorpus.py factor
+    Generate a synthetic corpus with factor times as many tablets as the real one,
+    e.g. 10, 100 or 1000
+python3 synthCorpus.py factor seed
+    Same, with another seed for the random choices than 1
+
+The corpus is written to {SYNTH_DIR}/<factor>x/json and can be converted by
+python3 tfFromJson.py -synthetic=<factor>
+and measured by
+python3 benchConvert.py -synthetic=<factor>
+"""
+
+# SYNTHETIC TABLETS
+#
+# The generator learns from the real corpus and writes tablets that the converters
+# accept, with realistic distributions of line types, sign types, clusters,
+# variants and lemmas.
+#
+# Every synthetic tablet takes the lines of a randomly chosen real tablet as
+# skeleton: faces, columns, line numbers, rulings, translations and notes stay as
+# they are, so the distribution of line types is that of the corpus.
+# The words and other tokens of the text lines are replaced by tokens drawn from
+# the whole corpus.
+#
+# A token can only be replaced by a token of the same kind and shape.
+# The shape is the sequence of what the director does with it: opening, closing
+# and continuing clusters, shifting language, and making signs, where consecutive
+# signs count as one.
+# So the clusters that are open before and after every token stay the same, and
+# clusters are never nested, closed without being open, or left dangling.
+# Tokens are drawn with their frequencies in the corpus, together with their
+# signs, variants, determinatives and lemmas.
+
+SEED = 1
+
+CLUSTER_SIGNS = {
+    "AccidentalOmission",
+    "Erasure",
+    "Removal",
+    "BrokenAway",
+    "PerhapsBrokenAway",
+    "DocumentOrientedGloss",
+}
+
+SIDES = dict(LEFT="open", RIGHT="close", CENTER="continue")
+
+
+def msg(m):
+    sys.stdout.write(f"{m}\n")
+
+
+def signShape(data, shape):
+    signType = data["type"]
+
+    if signType in CLUSTER_SIGNS:
+        shape.append((clusterType[signType], SIDES[data["side"]]))
+    elif signType == "LanguageShift":
+        shape.append(("lang",))
+    elif signType == "Joiner":
+        pass
+    else:
+        atf = data["value"]
+        indexStart = atf.find("[")
+        indexEnd = atf.find("]")
+        startMissingInternal = atf != "[" and indexStart >= 0
+        endMissingInternal = atf != "]" and indexEnd >= 0
+
+        if startMissingInternal and not endMissingInternal:
+            shape.append(("missing", "open"))
+        if not shape or shape[-1] != ("sign",):
+            shape.append(("sign",))
+        if endMissingInternal and not startMissingInternal:
+            shape.append(("missing", "close"))
+
+
+def tokenShape(token):
+    """What the director does with a token, see the comment above."""
+    shape = []
+
+    if "parts" in token:
+        for part in token["parts"]:
+            if "parts" in part:
+                shape.append(("det", "open"))
+                for subPart in part["parts"]:
+                    signShape(subPart, shape)
+                shape.append(("det", "close"))
+            elif "tokens" in part:
+                for subPart in part["tokens"]:
+                    signShape(subPart, shape)
+            else:
+                signShape(part, shape)
+    else:
+        signShape(token, shape)
+
+    return (token["type"], "parts" in token, tuple(shape))
+
+
+def learn(paths):
+    """Read the real corpus: the tablets and the tokens by shape."""
+    docs = []
+    tokens = collections.defaultdict(list)
+
+    for path in paths:
+        data = readJsonFile(path)
+        docs.append(data)
+        for line in data["text"]["allLines"]:
+            if line["type"] == "TextLine":
+                for token in line["content"]:
+                    tokens[tokenShape(token)].append(token)
+
+    return (docs, tokens)
+
+
+def lineAtf(line):
+    content = " ".join(c["value"] for c in line["content"])
+    return f"{line['prefix']} {content}"
+
+
+def makeTablet(k, skeleton, tokens, rng):
+    lines = []
+    for line in skeleton["text"]["allLines"]:
+        if line["type"] == "TextLine":
+            line = dict(
+                line,
+                content=[rng.choice(tokens[tokenShape(t)]) for t in line["content"]],
+            )
+        lines.append(line)
+
+    tablet = {key: value for (key, value) in skeleton.items() if key != "text"}
+    tablet.update(
+        number=f"SYN.{k}",
+        cdliNumber=f"P9{k:06d}",
+        text=dict(skeleton["text"], allLines=lines),
+        atf="\n".join(lineAtf(line) for line in lines),
+    )
+    return tablet
+
+
+def main(factor, seed):
+    rng = random.Random(seed)
+    (docs, tokens) = learn(getJsonFiles(IN_DIR))
+    nTokens = sum(len(ts) for ts in tokens.values())
+    msg(f"Learned {nTokens} tokens in {len(tokens)} shapes from {len(docs)} tablets")
+
+    (jsonDir, tfDir, workDir) = synthDirs(factor)
+    os.makedirs(jsonDir, exist_ok=True)
+    for name in os.listdir(jsonDir):
+        if name.endswith(".json"):
+            os.remove(f"{jsonDir}/{name}")
+
+    nTablets = factor * len(docs)
+    nLines = 0
+    for k in range(1, nTablets + 1):
+        tablet = makeTablet(k, rng.choice(docs), tokens, rng)
+        nLines += len(tablet["text"]["allLines"])
+        fileName = f"{tablet['number']} -- {tablet['cdliNumber']}.json"
+        with open(f"{jsonDir}/{fileName}", "w") as fh:
+            json.dump(tablet, fh, ensure_ascii=False)
+        if k % 1000 == 0:
+            msg(f"{k:>7} tablets")
+
+    msg(f"{nTablets} tablets with {nLines} lines written to {jsonDir}")
+
+
+args = sys.argv[1:]
+
+if len(args) in {1, 2} and all(arg.isdigit() for arg in args):
+    main(int(args[0]), int(args[1]) if len(args) == 2 else SEED)
+else:
+    msg(HELP.replace("{SYNTH_DIR}", SYNTH_DIR))
@@ -1,13 +1,17 @@
 import sys
 import os
 import re
-import json
 import yaml
 from shutil import rmtree
 
 from tf.fabric import Fabric
 from tf.convert.walker import CV
 
+from jsonSource import Manifest, ParseCache, readJsonFiles, streamJsonFile
+from fragments import RecordingCV, Fragments, fileHash, replay
+from instrument import Instrument, clusterCategory, signCategory
+from lineLexer import SIGN, WORD, lexLine
+
 HELP = """
 python3 tfFromJson.py
     Generate TF and if successful, load it
@@ -20,6 +24,28 @@ python3 tfFromJson.py -skipgen
     Load TF
 python3 tfFromJson.py -skipload
     Generate TF but do not load it
+
+Options, to be combined with the commands above:
+
+-full
+    Do not use cached fragments of unchanged documents
+-stream
+    Read the JSON line by line, with bounded memory
+-cache
+    Read the JSON through the parse cache, which keeps a slim, fast loading
+    copy of every tablet
+-profile
+    Count and time documents, line types, sign types, cluster transitions and
+    feature calls, and capture the walk with cProfile and tracemalloc;
+    the results are written as JSON to the temp directory and summarized
+    in tables of the most expensive items
+-synthetic=n
+    Convert the synthetic corpus that synthCorpus.py has generated at n times
+    the size of the real corpus, into the temp directory instead of into tf
+
+Normally, only documents that have changed since the previous run are converted;
+for the other documents the conversion result of the previous run is reused.
+When a Pnumber is given, all fragments are ignored.
 """
 
 TEST = """
@@ -69,6 +95,48 @@ VERSION_TF = META_DECL["versionTf"]
 IN_DIR = f"{REPO_DIR}/source/json/{VERSION_SRC}"
 TF_DIR = f"{REPO_DIR}/tf"
 OUT_DIR = f"{TF_DIR}/{VERSION_TF}"
+TEMP_DIR = f"{REPO_DIR}/_temp"
+FRAGMENT_DIR = f"{TEMP_DIR}/fragments/{VERSION_SRC}"
+MANIFEST_FILE = f"{TEMP_DIR}/manifest-{VERSION_SRC}.json"
+PARSE_DIR = f"{TEMP_DIR}/parsed/{VERSION_SRC}"
+PROFILE_FILE = f"{TEMP_DIR}/profile/convert-{VERSION_SRC}.json"
+SYNTH_DIR = f"{TEMP_DIR}/synthetic"
+
+
+def synthDirs(factor):
+    """Where the synthetic corpus of a scale factor lives.
+
+    Returns the directory of its JSON, of its TF, and of its other files.
+    """
+    base = f"{SYNTH_DIR}/{factor}x"
+    return (f"{base}/json", f"{base}/tf/{VERSION_TF}", base)
+
+
+def useSynthetic(factor):
+    """Let the converter work on a synthetic corpus instead of the real one."""
+    global IN_DIR
+    global OUT_DIR
+    global MANIFEST_FILE
+    global FRAGMENT_DIR
+    global PARSE_DIR
+    global PROFILE_FILE
+
+    (IN_DIR, OUT_DIR, base) = synthDirs(factor)
+    MANIFEST_FILE = f"{base}/manifest.json"
+    FRAGMENT_DIR = f"{base}/fragments"
+    PARSE_DIR = f"{base}/parsed"
+    PROFILE_FILE = f"{base}/profile.json"
+
+
+# fragments are only valid for the converter that produced them:
+# this program and the modules of this directory that the director relies on
+
+CONVERTER_MODULES = ("jsonSource", "fragments", "instrument", "lineLexer")
+
+CONVERTER_SALT = ":".join(
+    [VERSION_TF, fileHash(__file__)]
+    + [fileHash(sys.modules[name].__file__) for name in CONVERTER_MODULES]
+)
 
 META_FIELDS = {
     "collection": ("collection", "str"),
@@ -247,28 +315,6 @@ def msg(m):
     sys.stdout.write(f"{m}\n")
 
 
-def getJsonFiles():
-    filePaths = []
-
-    def walk(path):
-        with os.scandir(path) as it:
-            for entry in it:
-                name = entry.name
-                if not name.startswith(".") and entry.is_dir():
-                    walk(f"{path}/{name}")
-                elif name.endswith(".json") and entry.is_file:
-                    filePaths.append(f"{path}/{name}")
-
-    walk(IN_DIR)
-    return sorted(filePaths)
-
-
-def readJsonFile(path):
-    with open(path) as fh:
-        data = json.load(fh)
-    return data
-
-
 def writeReport(fName, lines):
     with open(f"{REPORT_DIR}/{fName}", "w") as fh:
         for line in lines:
@@ -283,17 +329,27 @@ def getConverter():
 PNUMBER = None
 FACE = None
 LINE = None
+INCREMENTAL = True
+STREAM = False
+CACHE = False
+PROFILE = False
+INSTRUMENT = Instrument()
+generateTf = True
 
 
 def convert():
+    global INSTRUMENT
+
     if generateTf:
         if os.path.exists(OUT_DIR):
             rmtree(OUT_DIR)
         os.makedirs(OUT_DIR, exist_ok=True)
 
     cv = getConverter()
+    INSTRUMENT = Instrument(enabled=PROFILE)
 
-    return cv.walk(
+    good = INSTRUMENT.capture(
+        cv.walk,
         director,
         slotType,
         otext=otext,
@@ -303,12 +359,73 @@ def convert():
         generateTf=generateTf,
     )
 
+    if PROFILE:
+        INSTRUMENT.writeReport(PROFILE_FILE)
+        for line in INSTRUMENT.table():
+            msg(line)
+        msg(f"Profile written to {PROFILE_FILE}")
+
+    return good
+
+
+# SIGN RECORDS
+
+
+class SignRecord:
+    """Collects the features of the current sign and assigns them in one go.
+
+    The director assigns features to a sign in many steps, and extends some of them
+    when later material closes clusters, determinatives and variants.
+    Instead of a walker call for each step, the features are collected here and
+    passed to the walker when the next sign starts or the line ends.
+
+    As in the walker, `None` values are not assigned and later values win.
+    Calls for other nodes than the current sign go to the walker directly.
+    """
+
+    __slots__ = ("cv", "node", "features")
+
+    def __init__(self, cv):
+        self.cv = cv
+        self.node = None
+        self.features = {}
+
+    def start(self, node):
+        self.flush()
+        self.node = node
+
+    def feature(self, node, **features):
+        if node is None or node != self.node:
+            self.cv.feature(node, **features)
+        elif None in features.values():
+            current = self.features
+            for (k, v) in features.items():
+                if v is not None:
+                    current[k] = v
+        else:
+            self.features.update(features)
+
+    def get(self, feature, node):
+        if node is None or node != self.node:
+            return self.cv.get(feature, node)
+        return self.features.get(feature, None)
+
+    def flush(self):
+        if self.node is not None:
+            if self.features:
+                self.cv.feature(self.node, **self.features)
+            self.node = None
+            self.features = {}
+
 
 # DIRECTOR
 
 
 def director(cv):
     DEBUG = False
+    instrument = INSTRUMENT
+    cv = instrument.wrapCv(RecordingCV(cv))
+    record = SignRecord(cv)
     curClusters = {cluster: (None, 0) for cluster in clusterType.values()}
 
     def debug(m):
@@ -373,13 +490,13 @@ def director(cv):
         if len(flagList):
             flags = "".join(flagList)
             atts = {flagging[flag]: 1 for flag in flags}
-            cv.feature(cur, flags=flags, **atts)
+            record.feature(cur, flags=flags, **atts)
 
     def doModifiers(data, cur):
         modifierList = data.get("modifiers", [])
         if len(modifierList):
             modifiers = "".join(m[1:] for m in modifierList)
-            cv.feature(cur, modifiers=f"@{modifiers}")
+            record.feature(cur, modifiers=f"@{modifiers}")
 
     def doSign(data, wordAfter, isLast, **features):
         nonlocal curSign
@@ -402,10 +519,10 @@ def director(cv):
             if status is True:
                 nextPre += clusterChar[cluster][status]
             elif status is False:
-                cv.feature(
+                record.feature(
                     curSign,
-                    after=(cv.get("after", curSign) or "") + after,
-                    atfpost=(cv.get("atfpost", curSign) or "")
+                    after=(record.get("after", curSign) or "") + after,
+                    atfpost=(record.get("atfpost", curSign) or "")
                     + clusterChar[cluster][status],
                 )
             elif status is None:
@@ -419,7 +536,7 @@ def director(cv):
 
         elif signType == "Joiner":
             if curSign is not None:
-                cv.feature(curSign, after=data["value"])
+                record.feature(curSign, after=data["value"])
 
         else:
             atf = data["value"]
@@ -445,6 +562,7 @@ def director(cv):
                 doCluster(data, "missing", on=True, off=False)
 
             curSign = cv.slot()
+            record.start(curSign)
 
             if endMissingInternal and not startMissingInternal:
                 atf = atf.replace("]", "")
@@ -458,7 +576,7 @@ def director(cv):
             atfPostFeat = dict(atfpost=atfPost) if atfPost else {}
             atfPost = ""
 
-            cv.feature(
+            record.feature(
                 curSign,
                 **atfPreFeat,
                 **atfPostFeat,
@@ -512,15 +630,69 @@ def director(cv):
             else:
                 error(f"unrecognized sign type {signType}", stop=True)
 
-            cv.feature(curSign, type=tp, after=after, sym=sym, **feats)
+            record.feature(curSign, type=tp, after=after, sym=sym, **feats)
 
-    paths = getJsonFiles()
+    doCluster = instrument.timed(doCluster, clusterCategory)
+    doSign = instrument.timed(doSign, signCategory, unit="signs")
+
+    manifest = Manifest(IN_DIR, MANIFEST_FILE)
+    paths = manifest.paths()
     skipFace = FACE is not None
     skipLine = LINE is not None
 
+    def wanted(path):
+        return PNUMBER is None or manifest.entry(path)["pnumber"] == PNUMBER
+
+    # unchanged documents are replayed from their fragments, the others are converted
+
+    fragments = (
+        Fragments(
+            FRAGMENT_DIR,
+            salt=CONVERTER_SALT,
+            hashOf=lambda path: manifest.entry(path)["hash"],
+        )
+        if INCREMENTAL and PNUMBER is None
+        else None
+    )
+    todoPaths = [
+        p
+        for p in paths
+        if wanted(p) and (fragments is None or not fragments.has(p))
+    ]
+
+    # the JSON is decoded in parallel, ahead of the walk, in the order of paths,
+    # or, when streaming, line by line while walking
+
+    metaKeys = {origField.split(".", 1)[0] for origField in META_FIELDS}
+    parseCache = ParseCache(PARSE_DIR, manifest) if CACHE and not STREAM else None
+    docs = (
+        ((path, *streamJsonFile(path, metaKeys)) for path in todoPaths)
+        if STREAM
+        else (
+            (path, docData, docData["text"]["allLines"])
+            for (path, docData) in readJsonFiles(
+                todoPaths, keys=metaKeys | {"text"}, cache=parseCache
+            )
+        )
+    )
+
     for (i, path) in enumerate(paths):
+        if not wanted(path):
+            continue
+
         fileName = path.split("/")[-1].rsplit(".", 1)[0]
-        docData = readJsonFile(path)
+
+        fragment = None if fragments is None else fragments.get(path)
+        instrument.document(fileName, replayed=fragment is not None)
+        if fragment is not None:
+            nLines = fragment["nLines"]
+            msg(f"{i + 1:>3} {nLines:>4} lines in {fileName} (unchanged)")
+            replay(cv, fragment["ops"])
+            continue
+
+        (docPath, docData, textData) = next(docs)
+        if docPath != path:
+            error(f"decoded {docPath} instead of {path}", stop=True)
         metaData = {}
         for (origField, (field, tp)) in META_FIELDS.items():
             origFields = origField.split(".", 1)
@@ -533,13 +705,17 @@ def director(cv):
         if PNUMBER is not None and PNUMBER != pNumber:
             continue
 
-        textData = docData["text"]["allLines"]
-        nLines = len(textData)
+        nLines = manifest.entry(path)["lines"]
 
         msg(f"{i + 1:>3} {nLines:>4} lines in {fileName}")
         if nLines == 0:
+            if fragments is not None:
+                fragments.put(path, [], nLines=nLines)
             continue
 
+        if fragments is not None:
+            cv.start()
+
         curDoc = cv.node("document")
         cv.feature(curDoc, **metaData)
         curFace = None
@@ -554,6 +730,7 @@ def director(cv):
             lang = None
 
             lineType = lineData["type"]
+            instrument.line(lineType)
             content = " ".join(c["value"] for c in lineData["content"])
             atf = f"{lineData['prefix']} {content}"
 
@@ -659,65 +836,14 @@ def director(cv):
                     debug(atf)
                     cv.feature(curLine, ln=ln, **primelnAtt, lnno=lnno)
 
-                    lineContent = lineData["content"]
-
-                    lineSigns = []
-
-                    for wordData in lineContent:
-                        if "parts" in wordData:
-                            lineSigns.append([True, wordData, False])
-                            for signData in wordData["parts"]:
-                                hasSubs = False
-                                for (kind, tp) in (
-                                    ("parts", "Determinative"),
-                                    ("tokens", "Variant"),
-                                ):
-                                    if kind in signData:
-                                        hasSubs = True
-                                        end = len(signData[kind])
-                                        for (i, subPart) in enumerate(signData[kind]):
-                                            lineSigns.append(
-                                                [
-                                                    False,
-                                                    subPart,
-                                                    False,
-                                                    tp,
-                                                    i,
-                                                    i == end - 1,
-                                                ]
-                                            )
-                                if not hasSubs:
-                                    lineSigns.append([False, signData, False])
-                        else:
-                            lineSigns.append([None, wordData, None])
-
-                    for entry in reversed(lineSigns):
-                        isWord = entry[0]
-                        if isWord:
-                            entry[2] = True
-                            break
-
-                    atWordEnd = True
-                    for entry in reversed(lineSigns):
-                        isWord = entry[0]
-                        if isWord is False:
-                            if atWordEnd:
-                                entry[2] = True
-                                atWordEnd = False
-                        elif isWord is True:
-                            atWordEnd = True
-
                     curWord = None
                     curSign = None
                     nextPre = ""
 
-                    for (e, entry) in enumerate(lineSigns):
-                        isWord = entry[0]
-                        data = entry[1]
-                        isLast = entry[2]
-                        where = None if len(entry) < 4 else entry[3]
+                    for token in lexLine(lineData["content"]):
+                        (kind, data, isLast, group, index, atEnd, part) = token
                         contentType = data["type"]
-                        if isWord:
+                        if kind == WORD:
                             if curWord:
                                 cv.terminate(curWord)
                             atf = data["value"]
@@ -732,34 +858,27 @@ def director(cv):
                                 atts = {} if lang is None else dict(lang=lang)
                                 cv.feature(curWord, type="word", **atts, lemma=lemma)
 
-                        elif isWord is False:
-                            if len(entry) > 3:
-                                tp = entry[3]
-                                where = entry[4]
-                                atEnd = entry[5]
-                                atts = {}
-                                if tp == "Determinative":
-                                    if where == 0:
-                                        doCluster(data, "det", on=True, off=False)
-                                        nextPre += "{"
-                                    doSign(data, wordAfter, isLast)
-                                    if atEnd:
-                                        cv.feature(
-                                            curSign,
-                                            atfpost=(cv.get("atfpost", curSign) or "")
-                                            + "}",
-                                        )
-                                        doCluster(data, "det", on=False, off=True)
-                                elif tp == "Variant":
-                                    doSign(data, wordAfter, isLast, variant=where + 1)
-                                    if not atEnd:
-                                        cv.feature(
-                                            curSign,
-                                            atfpost=(cv.get("atfpost", curSign) or "")
-                                            + "/",
-                                        )
-                                else:
-                                    error(f"Unknown complex type: {tp}", stop=True)
+                        elif kind == SIGN:
+                            if group == "Determinative":
+                                if index == 0:
+                                    doCluster(data, "det", on=True, off=False)
+                                    nextPre += "{"
+                                doSign(data, wordAfter, isLast)
+                                if atEnd:
+                                    record.feature(
+                                        curSign,
+                                        atfpost=(record.get("atfpost", curSign) or "")
+                                        + "}",
+                                    )
+                                    doCluster(data, "det", on=False, off=True)
+                            elif group == "Variant":
+                                doSign(data, wordAfter, isLast, variant=index + 1)
+                                if not atEnd:
+                                    record.feature(
+                                        curSign,
+                                        atfpost=(record.get("atfpost", curSign) or "")
+                                        + "/",
+                                    )
                             else:
                                 doSign(data, wordAfter, isLast)
                         else:
@@ -771,6 +890,7 @@ def director(cv):
                             stop=True,
                         )
 
+                    record.flush()
                     cv.terminate(curWord)
 
                 prevLine = curLine
@@ -832,6 +952,16 @@ def director(cv):
             cv.terminate(curFace)
         cv.terminate(curDoc)
 
+        if fragments is not None:
+            ops = cv.stop()
+            if ops is not None:
+                fragments.put(path, ops, nLines=nLines)
+
+    instrument.done()
+
+    if fragments is not None:
+        fragments.prune()
+
     # delete meta data of unused features
 
     for feat in featureMeta:
@@ -858,31 +988,66 @@ def loadTf():
 
 # MAIN
 
-command = None if len(sys.argv) <= 1 else sys.argv[1]
+OPTIONS = {"-full", "-stream", "-cache", "-profile"}
+
+
+def main(args):
+    global INCREMENTAL
+    global STREAM
+    global CACHE
+    global PROFILE
+    global PNUMBER
+    global FACE
+    global LINE
+    global generateTf
+
+    synthetic = [arg for arg in args if arg.startswith("-synthetic=")]
+    options = {arg for arg in args if arg in OPTIONS}
+    commands = [arg for arg in args if arg not in OPTIONS and arg not in synthetic]
+    command = None if len(commands) == 0 else commands[0]
+
+    INCREMENTAL = "-full" not in options
+    STREAM = "-stream" in options
+    CACHE = "-cache" in options
+    PROFILE = "-profile" in options
+
+    msg(f"JSON to TF converter for {REPO}")
+    msg(f"ATF source version = {VERSION_SRC}")
+    msg(f"TF  target version = {VERSION_TF}")
+
+    factors = [arg.split("=", 1)[1] for arg in synthetic]
+    if factors:
+        if len(factors) > 1 or not factors[0].isdigit():
+            msg(f"Wrong option {' '.join(synthetic)} !\n{HELP}")
+            return
+        useSynthetic(int(factors[0]))
+        msg(f"Synthetic corpus = {IN_DIR}")
+
+    if len(commands) > 1:
+        msg(f"Too many commands {' '.join(commands)} !\n{HELP}")
+    elif command is None:
+        generateTf = True
+        good = convert()
+        if good:
+            loadTf()
+    elif command.startswith("P"):
+        generateTf = True
+        parts = command.split(":", 1)
+        PNUMBER = parts[0]
+        if len(parts) > 1:
+            parts = parts[1].split(":", 1)
+            FACE = parts[0]
+            if len(parts) > 1:
+                LINE = parts[1].replace("'", "")
+        convert()
+    elif command == "-skipload":
+        generateTf = True
+        convert()
+    elif command == "-skipgen":
+        loadTf()
+    else:
+        msg(f"Wrong command {command} !\n{HELP}")
 
-msg(f"JSON to TF converter for {REPO}")
-msg(f"ATF source version = {VERSION_SRC}")
-msg(f"TF  target version = {VERSION_TF}")
 
-if command is None:
-    generateTf = True
-    good = convert()
-    if good:
-        loadTf()
-elif command.startswith("P"):
-    generateTf = True
-    parts = command.split(":", 1)
-    PNUMBER = parts[0]
-    if len(parts) > 1:
-        parts = parts[1].split(":", 1)
-        FACE = parts[0]
-        if len(parts) > 1:
-            LINE = parts[1].replace("'", "")
-    convert()
-elif command == "-skipload":
-    generateTf = True
-    convert()
-elif command == "-skipgen":
-    loadTf()
-else:
-    msg(f"Wrong command {command} !\n{HELP}")
+if __name__ == "__main__":
+    main(sys.argv[1:])
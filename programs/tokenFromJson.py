@@ -3,6 +3,11 @@ import os
 import json
 import yaml
 
+from functools import partial
+
+from jsonSource import Manifest, ParseCache, streamJsonFile, mapFiles, poolSize
+from jsonPaths import PathQuery
+
 
 def readYaml(fileName):
     if os.path.exists(fileName):
@@ -26,6 +31,9 @@ META_DECL = readYaml(META_DECL_FILE)
 VERSION_SRC = META_DECL["versionSrc"]
 VERSION_TF = META_DECL["versionTf"]
 SRC_DIR = f"{REPO_DIR}/source/json/{VERSION_SRC}"
+TEMP_DIR = f"{REPO_DIR}/_temp"
+MANIFEST_FILE = f"{TEMP_DIR}/manifest-{VERSION_SRC}.json"
+PARSE_DIR = f"{TEMP_DIR}/parsed/{VERSION_SRC}"
 
 SKIP_KEYS = set(
     """
@@ -41,20 +49,26 @@ script
 )
 
 
-def getJsonFiles():
-    filePaths = []
+parseCache = None
+
 
-    def walk(path):
-        with os.scandir(path) as it:
-            for entry in it:
-                name = entry.name
-                if not name.startswith(".") and entry.is_dir():
-                    walk(f"{path}/{name}")
-                elif name.endswith(".json") and entry.is_file:
-                    filePaths.append(f"{path}/{name}")
+def useParseCache(on=True):
+    """Read documents through the parse cache shared with tfFromJson.
 
-    walk(SRC_DIR)
-    return sorted(filePaths)
+    The cache holds slim documents, made for the converter.
+    Only a run of reports that all do with slim documents makes use of it;
+    inventories of keys and the report of json paths need the full JSON, so the
+    complete set of reports does not benefit from the cache.
+    """
+    global parseCache
+    parseCache = ParseCache(PARSE_DIR, Manifest(SRC_DIR, MANIFEST_FILE)) if on else None
+
+
+def getJsonFiles():
+    manifest = Manifest(SRC_DIR, MANIFEST_FILE)
+    if parseCache is not None:
+        parseCache.refresh(manifest)
+    return manifest.paths()
 
 
 def readJsonFile(path):
@@ -63,56 +77,47 @@ def readJsonFile(path):
     return data
 
 
+def readDoc(path):
+    return readJsonFile(path) if parseCache is None else parseCache.read(path)
+
+
 def writeReport(fName, lines):
-    with open(f"{REPORT_DIR}/{fName}", "w") as fh:
-        for line in lines:
-            fh.write(f"{line}\n")
+    text = "".join(f"{line}\n" for line in lines)
+    path = f"{REPORT_DIR}/{fName}"
+    if os.path.exists(path):
+        with open(path) as fh:
+            if fh.read() == text:
+                return False
+    with open(path, "w") as fh:
+        fh.write(text)
+    return True
 
 
 def investigate(data):
     entries = []
 
-    def walk(path, info):
-        if type(info) is dict:
-            for (k, v) in sorted(info.items()):
-                pathRep = f"{path}." if path else ""
-                walk(f"{pathRep}{k}", v)
-        elif type(info) is list:
-            for v in info:
-                pathRep = f"{path}[]" if path else ""
-                walk(f"{pathRep}", v)
-        else:
-            entries.append((path, info))
+    def emit(path, info):
+        entries.append((path, info))
 
-    walk("", data)
+    PathQuery(()).leaves(data, emit)
     return entries
 
 
 def filter(data, include=None, exclude=set()):
     filtered = []
 
-    def walk(path, info):
-        if path in exclude:
-            return
-        if type(info) is dict:
-            for (k, v) in sorted(info.items()):
-                pathRep = f"{path}." if path else ""
-                walk(f"{pathRep}{k}", v)
-        elif type(info) is list:
-            for (k, v) in enumerate(info):
-                pathRep = f"{path}[{k}]" if path else ""
-                walk(f"{pathRep}", v)
-        else:
-            if type(info) is str:
-                nInfo = len(info)
-                if nInfo > 20:
-                    info = info[0:20].replace("\n", " ") + "..."
-            filtered.append((path, info))
+    def emit(path, info):
+        if type(info) is str:
+            nInfo = len(info)
+            if nInfo > 20:
+                info = info[0:20].replace("\n", " ") + "..."
+        filtered.append((path, info))
 
+    query = PathQuery((), skip=exclude)
     if include is None:
-        walk("", data)
+        query.leaves(data, emit, indices=True)
     else:
-        walk("", data.get(include, {}))
+        query.leaves(data.get(include, {}), emit, indices=True)
     return filtered
 
 
@@ -136,137 +141,174 @@ def compact(path, doMeta=False, doText=False):
     print(f"{pNum}\n{meta}\n{text}")
 
 
+queries = {}
+
+
+def getQuery(keys, full):
+    """Compile a query for keys, or retrieve it if it has been compiled before."""
+    queryKey = (keys, full)
+    query = queries.get(queryKey, None)
+    if query is None:
+        exempt = [i for (i, isFull) in enumerate(full) if isFull]
+        query = PathQuery(keys, skip=SKIP_KEYS, exempt=exempt)
+        queries[queryKey] = query
+    return query
+
+
+def analyseKeys(data, specs):
+    """Inventory the values of several keys in a single walk through the data.
+
+    `specs` is a sequence of tuples `(theKey, instead, full)`,
+    with the meaning of the corresponding arguments of `analyse()`.
+    Returns an inventory per spec: a dict from paths to sets of values.
+    """
+    inventories = [collections.defaultdict(set) for spec in specs]
+    lookups = []
+
+    for (theKey, instead, full) in specs:
+        if instead is None:
+            lookups.append(None)
+        else:
+            (theValue, otherKey) = instead[0:2]
+            subKey = instead[2] if len(instead) >= 3 else None
+            lookups.append((theValue, otherKey, subKey))
+
+    def emit(i, path, info, parent):
+        entries = inventories[i]
+        lookupSpec = lookups[i]
+
+        if lookupSpec is None:
+            entries[path].add(repr(info))
+        else:
+            (theValue, otherKey, subKey) = lookupSpec
+            if info == theValue:
+                lookup = parent[otherKey]
+                if subKey is not None:
+                    lookup = (
+                        tuple(c[subKey] for c in lookup)
+                        if type(lookup) is list
+                        else lookup[subKey]
+                    )
+
+                entries[path].add(lookup)
+
+    keys = tuple(spec[0] for spec in specs)
+    full = tuple(bool(spec[2]) for spec in specs)
+    getQuery(keys, full).run(data, emit)
+    return inventories
+
+
+def reportFile(path, specs, visitorTypes):
+    """The partial results of all reports on a single file, from a single decode.
+
+    Returns the inventories of the keys in `specs`, and the partial results of
+    visitors, which are made anew for this file from their classes.
+    """
+    data = readJsonFile(path)
+    docNum = data["number"]
+    partials = []
+    for visitorType in visitorTypes:
+        report = visitorType()
+        report.visit(docNum, data)
+        partials.append(report.partial())
+    return (analyseKeys(data, specs), partials)
+
+
+def inventoryLines(entries):
+    lines = []
+    for (path, values) in sorted(entries.items()):
+        lines.append(path)
+        for value in sorted(values, key=str):
+            lines.append(f"\t{value}")
+    return lines
+
+
 def analyse(data, theKey, instead=None, asData=False, full=False):
-    entries = collections.defaultdict(set)
-    if instead is not None:
-        (theValue, otherKey) = instead[0:2]
-        subKey = instead[2] if len(instead) >= 2 else None
-
-    def walk(path, info, parent):
-        if not full and path in SKIP_KEYS:
-            return
-        if path == theKey or path.endswith(f".{theKey}") or path.endswith(f"]{theKey}"):
-            if instead is None:
-                entries[path].add(repr(info))
-            else:
-                if info == theValue:
-                    lookup = parent[otherKey]
-                    if subKey is not None:
-                        lookup = (
-                            tuple(c[subKey] for c in lookup)
-                            if type(lookup) is list
-                            else lookup[subKey]
-                        )
-
-                    entries[path].add(lookup)
-        elif type(info) is dict:
-            for (k, v) in sorted(info.items()):
-                pathRep = f"{path}." if path else ""
-                walk(f"{pathRep}{k}", v, info)
-        elif type(info) is list:
-            for v in info:
-                pathRep = f"{path}[]" if path else ""
-                walk(f"{pathRep}", v, info)
-
-    walk("", data, {})
+    entries = analyseKeys(data, [(theKey, instead, full)])[0]
     if asData == 1:
         return entries
-    lines = []
-    for (path, types) in sorted(entries.items(), key=lambda x: x[0]):
-        if asData:
-            lines.append(path)
-            for tp in types:
-                lines.append((f"\t{tp}"))
-        else:
-            print(path)
-            for tp in types:
-                print(f"\t{tp}")
+    lines = inventoryLines(entries)
     if asData:
         return lines
-
-
-def analyseAll(theKey, instead=None, asData=False, toFile=True, full=False):
-    data = []
-    for path in getJsonFiles():
-        data.append(readJsonFile(path))
-    lines = analyse(data, theKey, instead=instead, asData=True, full=full)
+    print("\n".join(lines))
+
+
+def analyseAll(
+    theKey,
+    instead=None,
+    asData=False,
+    toFile=True,
+    full=False,
+    workers=None,
+    asEntries=False,
+):
+    """Inventory the values of a key in the whole corpus.
+
+    If `asData`, the lines of the report are returned; if `asEntries`, the
+    inventory itself: a dict of sets of values keyed by path.
+    Otherwise the report is written or printed.
+    """
+    report = AnalyseReport(theKey, instead=instead, full=full)
+    makeReports([report], toFile=False, workers=workers)
+    if asEntries:
+        return report.entries
+    lines = report.lines()
     if asData:
         return lines
-    elif toFile:
-        base = theKey if instead is None else f"{theKey}-{instead[0]}-{instead[1]}"
-        writeReport(f"{base}.txt", lines)
+    if toFile:
+        writeReport(report.fileName, lines)
     else:
         print("\n".join(lines))
 
 
-def output(items, toFile, fileName):
+def outputLines(items):
     lines = []
     for (item, docNums) in items.items():
         lines.append(item)
-        for docNum in docNums:
+        for docNum in sorted(docNums) if type(docNums) is set else docNums:
             lines.append(f"\t{docNum}")
+    return lines
+
+
+def output(items, toFile, fileName):
+    lines = outputLines(items)
     if toFile:
         writeReport(fileName, lines)
     else:
         print("\n".join(lines))
 
 
-def getData():
+def getData(stream=False):
     for path in getJsonFiles():
-        data = readJsonFile(path)
+        if stream:
+            (data, lines) = streamJsonFile(path, {"number"})
+            data["text"] = dict(allLines=lines)
+        else:
+            data = readDoc(path)
         docNum = data["number"]
         yield (docNum, data)
 
 
-def getFaces(toFile=True):
-    fileName = "faces.txt"
-    items = collections.defaultdict(list)
-    for (docNum, data) in getData():
-        for lineData in data["text"]["allLines"]:
-            if lineData["type"] != "SurfaceAtLine":
-                continue
-            value = lineData["displayValue"]
-            items[value].append(docNum)
-    output(items, toFile, fileName)
+def runReport(report, toFile, stream):
+    for (docNum, data) in getData(stream=stream):
+        report.visit(docNum, data)
+    output(report.items, toFile, report.fileName)
 
 
-def getColumns(toFile=True):
-    fileName = "columns.txt"
-    items = collections.defaultdict(list)
-    for (docNum, data) in getData():
-        for lineData in data["text"]["allLines"]:
-            if lineData["type"] != "ColumnAtLine":
-                continue
-            value = lineData["displayValue"]
-            items[value].append(docNum)
-    output(items, toFile, fileName)
+def getFaces(toFile=True, stream=False):
+    runReport(FacesReport(), toFile, stream)
 
 
-def getContentTypes(toFile=True):
-    fileName = "contenttypes.txt"
-    items = collections.defaultdict(set)
-    for (docNum, data) in getData():
-        for lineData in data["text"]["allLines"]:
-            for contentData in lineData["content"]:
-                contentType = contentData["type"]
-                items[contentType].add(docNum)
-    output(items, toFile, fileName)
+def getColumns(toFile=True, stream=False):
+    runReport(ColumnsReport(), toFile, stream)
 
 
-def getVariants(toFile=True):
-    fileName = "variants.txt"
-    items = collections.defaultdict(set)
-    for (docNum, data) in getData():
-        for lineData in data["text"]["allLines"]:
-            for contentData in lineData["content"]:
-                contentType = contentData["type"]
-                if contentType == "Word":
-                    for signData in contentData["parts"]:
-                        signType = signData["type"]
-                        if signType == "Variant":
-                            variant = signData["value"]
-                            items[variant].add(docNum)
-    output(items, toFile, fileName)
+def getContentTypes(toFile=True, stream=False):
+    runReport(ContentTypesReport(), toFile, stream)
+
+
+def getVariants(toFile=True, stream=False):
+    runReport(VariantsReport(), toFile, stream)
 
 
 META_KEYS = {
@@ -300,8 +342,7 @@ def getLine(line):
     return (prefix, content)
 
 
-def extractLines(path, asData=False):
-    data = readJsonFile(path)
+def docLines(data):
     pNum = data["cdliNumber"]
     xNum = data["number"]
 
@@ -313,16 +354,18 @@ def extractLines(path, asData=False):
         (prefix, content) = getLine(line)
         result.append(f"{pNum}-{xNum}: {prefix}: {content}")
 
+    return result
+
+
+def extractLines(path, asData=False):
+    result = docLines(readDoc(path))
     if asData:
         return result
     print("\n".join(result))
 
 
 def extractAllLines():
-    lines = []
-    for path in getJsonFiles():
-        lines.extend(extractLines(path, asData=True))
-    writeReport("all-lines.txt", lines)
+    makeReports([AllLinesReport()])
 
 
 def extract(path):
@@ -345,3 +388,248 @@ def extract(path):
         result.append(prefix)
 
     print("\n".join(result))
+
+
+# REPORTS
+#
+# Every report is a visitor that is shown all documents one by one.
+# Reports that inventory the values of keys are not visited separately:
+# they share a single walk through each document.
+# So all reports together cost a single read of the corpus.
+
+
+class Report:
+    fileName = None
+    # whether the report needs the full JSON, instead of the slim documents of the
+    # parse cache
+    full = False
+
+    def visit(self, docNum, data):
+        pass
+
+    def partial(self):
+        """The results so far, to be merged into a report of the same kind."""
+        return None
+
+    def merge(self, partial):
+        pass
+
+    def lines(self):
+        return []
+
+
+class AllLinesReport(Report):
+    fileName = "all-lines.txt"
+
+    def __init__(self):
+        self.result = []
+
+    def visit(self, docNum, data):
+        self.result.extend(docLines(data))
+
+    def partial(self):
+        return self.result
+
+    def merge(self, partial):
+        self.result.extend(partial)
+
+    def lines(self):
+        return self.result
+
+
+class AnalyseReport(Report):
+    def __init__(self, theKey, instead=None, full=False):
+        self.spec = (theKey, instead, full)
+        base = theKey if instead is None else f"{theKey}-{instead[0]}-{instead[1]}"
+        self.fileName = f"{base}.txt"
+        self.entries = collections.defaultdict(set)
+
+    def partial(self):
+        return self.entries
+
+    def merge(self, entries):
+        for (path, values) in entries.items():
+            self.entries[path] |= values
+
+    def visit(self, docNum, data):
+        self.merge(analyseKeys(data, [self.spec])[0])
+
+    def lines(self):
+        return inventoryLines(self.entries)
+
+
+class ItemsReport(Report):
+    unique = False
+
+    def __init__(self):
+        self.items = collections.defaultdict(set if self.unique else list)
+
+    def add(self, item, docNum):
+        if self.unique:
+            self.items[item].add(docNum)
+        else:
+            self.items[item].append(docNum)
+
+    def partial(self):
+        return self.items
+
+    def merge(self, items):
+        for (item, docNums) in items.items():
+            if self.unique:
+                self.items[item] |= docNums
+            else:
+                self.items[item].extend(docNums)
+
+    def lines(self):
+        return outputLines(self.items)
+
+
+class FacesReport(ItemsReport):
+    fileName = "faces.txt"
+
+    def visit(self, docNum, data):
+        for lineData in data["text"]["allLines"]:
+            if lineData["type"] == "SurfaceAtLine":
+                self.add(lineData["displayValue"], docNum)
+
+
+class ColumnsReport(ItemsReport):
+    fileName = "columns.txt"
+
+    def visit(self, docNum, data):
+        for lineData in data["text"]["allLines"]:
+            if lineData["type"] == "ColumnAtLine":
+                self.add(lineData["displayValue"], docNum)
+
+
+class ContentTypesReport(ItemsReport):
+    fileName = "contenttypes.txt"
+    unique = True
+
+    def visit(self, docNum, data):
+        for lineData in data["text"]["allLines"]:
+            for contentData in lineData["content"]:
+                self.add(contentData["type"], docNum)
+
+
+class VariantsReport(ItemsReport):
+    fileName = "variants.txt"
+    unique = True
+
+    def visit(self, docNum, data):
+        for lineData in data["text"]["allLines"]:
+            for contentData in lineData["content"]:
+                if contentData["type"] == "Word":
+                    for signData in contentData["parts"]:
+                        if signData["type"] == "Variant":
+                            self.add(signData["value"], docNum)
+
+
+class JsonPathsReport(Report):
+    fileName = "jsonpaths.txt"
+    full = True
+
+    def __init__(self):
+        self.paths = set()
+
+    def visit(self, docNum, data):
+        PathQuery(()).leaves(data, lambda path, info: self.paths.add(path))
+
+    def partial(self):
+        return self.paths
+
+    def merge(self, paths):
+        self.paths |= paths
+
+    def lines(self):
+        return sorted(self.paths)
+
+
+def corpusReports():
+    return [
+        AllLinesReport(),
+        AnalyseReport("flags"),
+        AnalyseReport("modifiers"),
+        AnalyseReport("type"),
+        AnalyseReport("type", instead=("LanguageShift", "value")),
+        AnalyseReport("enclosureType"),
+        AnalyseReport("language"),
+        AnalyseReport("uniqueLemma"),
+        AnalyseReport("script", full=True),
+        AnalyseReport("surface"),
+        AnalyseReport("status"),
+        AnalyseReport("erasure"),
+        FacesReport(),
+        ColumnsReport(),
+        ContentTypesReport(),
+        VariantsReport(),
+        JsonPathsReport(),
+    ]
+
+
+def makeReports(reports=None, toFile=True, workers=None):
+    """Produce reports in a single pass over the corpus.
+
+    By default, all reports in the report directory are produced.
+    If `toFile`, reports are written, but only if their content has changed.
+    Returns the reports, so that their results can also be used directly.
+
+    If there are inventories of keys, all reports are made per file in a pool
+    of `workers` processes (default: one per cpu): a worker decodes a file once,
+    and returns the partial inventories and the partial results of the other
+    reports, which are merged in the order of the files.
+    With a single worker everything happens in the main process,
+    and every file is read only once as well.
+    Without inventories, the reports are made in the main process
+    and can do with the slim documents of the parse cache, if it is in use,
+    unless one of them needs the full JSON.
+
+    So the parse cache never speeds up inventories, and hence not the default
+    run of all reports: it lacks the keys that inventories look for.
+    Its gain is for the converter, and for runs of a few slim reports only.
+    """
+    if reports is None:
+        reports = corpusReports()
+
+    analysers = [report for report in reports if isinstance(report, AnalyseReport)]
+    visitors = [report for report in reports if not isinstance(report, AnalyseReport)]
+    specs = [report.spec for report in analysers]
+
+    paths = getJsonFiles()
+    inPool = len(specs) > 0 and poolSize(len(paths), workers=workers) > 1
+    visitorTypes = [type(report) for report in visitors]
+    results = (
+        mapFiles(
+            partial(reportFile, specs=specs, visitorTypes=visitorTypes),
+            paths,
+            workers=workers,
+        )
+        if inPool
+        else None
+    )
+    needFull = specs or any(report.full for report in visitors)
+    read = readJsonFile if needFull else readDoc
+
+    for path in paths:
+        if inPool:
+            (inventories, partials) = next(results)[1]
+            for (report, part) in zip(visitors, partials):
+                report.merge(part)
+        elif visitors or specs:
+            data = read(path)
+            docNum = data["number"]
+            for report in visitors:
+                report.visit(docNum, data)
+            if specs:
+                inventories = analyseKeys(data, specs)
+
+        if specs:
+            for (report, entries) in zip(analysers, inventories):
+                report.merge(entries)
+
+    if toFile:
+        for report in reports:
+            written = writeReport(report.fileName, report.lines())
+            print(f"{'written' if written else 'unchanged':<9} {report.fileName}")
+
+    return reports